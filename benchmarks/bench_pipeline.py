@@ -0,0 +1,201 @@
+"""Benchmark of the whole pipeline on generated dumps (see generate_dump).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --pages 2000 --revisions 10 --output bench.json
+    python -m benchmarks.bench_pipeline --pages 2000 --revisions 10 --compare bench.json
+
+The dumps are generated in --work (deleted first) and processed by a project there, one file after the other:
+download from the generated mirror, Processor.split, parse and postprocessing_cat_link, then each step of
+ProcessorResults.process. get_data and links are the time spent in these methods during parse (links is part of
+get_data). Rates are given for the pages, revisions and uncompressed XML of all files, peak RSS is the largest
+resident set of the benchmark process and of its children up to the end of a step. The results are written as
+JSON, --compare prints the change of every step against an earlier result.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import datetime
+
+from benchmarks.generate_dump import add_arguments, generate, generator_from
+from wikiDumpParser.wikiDumpParser import Project
+from wikiDumpParser.processorData import Processor
+from wikiDumpParser.processorResults import ProcessorResults
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux.
+    return {'self_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0}
+
+
+class Timings(object):
+    """Seconds and calls of every step, in the order the steps were first timed."""
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+
+    def add(self, step, seconds):
+        self.seconds[step] = self.seconds.get(step, 0.0) + seconds
+        self.calls[step] = self.calls.get(step, 0) + 1
+
+    def run(self, step, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.add(step, time.perf_counter() - start)
+        return result
+
+    # Replaces method name of obj by one that adds the time of every call to step.
+    def wrap(self, obj, name, step):
+        method = getattr(obj, name)
+
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.add(step, time.perf_counter() - start)
+        setattr(obj, name, timed)
+
+
+def create_project(args, mirror):
+    project = Project('project')
+    project.create_project(start_date=args.start_date)
+    project.add_dump_file_info(os.path.join(mirror, 'md5.txt'), mirror)
+    project.set_parallel_processes(args.processes)
+    project.set_streaming(args.streaming)
+    project.set_parser_mode(args.parser_mode)
+    project.set_link_output(args.link_output)
+    project.set_page_workers(args.page_workers)
+    project.set_output_format(args.output_format)
+    project.set_title_ids(args.title_ids)
+    project.set_compression(args.compression)
+    return project
+
+
+def process_files(project, timings, steps):
+    for f in sorted(project.pinfo['dump']):
+        processor = Processor(f, project.data_path, project.pinfo['base_url'], 'init', project.pinfo['start_date'],
+                              project.pinfo['md5'][f], **project.processor_options())
+        # Pages are handed to workers with page_workers > 1, get_data and links can only be timed in this process.
+        if processor.page_workers == 1:
+            timings.wrap(processor, 'get_data', 'get_data')
+            timings.wrap(processor, 'links', 'links')
+        for step, function in (('download', processor.download_dump_file), ('split', processor.split),
+                               ('parse', processor.parse),
+                               ('postprocessing_cat_link', processor.postprocessing_cat_link)):
+            timings.run(step, function)
+            steps[step] = peak_rss()
+        project.set_file_status(f, 'post')
+    for step in ('get_data', 'links'):
+        steps[step] = steps['parse']
+
+
+def process_results(project, timings, steps):
+    results = ProcessorResults(project)
+    functions = [results.assemble_cat_results, results.update_revisions_file, results.group_links_files,
+                 results.group_page_info]
+    if results.title_ids:
+        functions.append(results.build_title_index)
+    functions += [results.remove_duplicate_authors, results.combine_parsed_results]
+    for function in functions:
+        timings.run(function.__name__, function)
+        steps[function.__name__] = peak_rss()
+
+
+def report(dumps, timings, steps):
+    pages = sum(f['pages'] for f in dumps)
+    revisions = sum(f['revisions'] for f in dumps)
+    mb = sum(f['xml_bytes'] for f in dumps) / 1048576.0
+    results = {}
+    for step, seconds in timings.seconds.items():
+        results[step] = {'seconds': seconds,
+                         'calls': timings.calls[step],
+                         'pages_per_s': pages / seconds if seconds > 0 else None,
+                         'revisions_per_s': revisions / seconds if seconds > 0 else None,
+                         'mb_per_s': mb / seconds if seconds > 0 else None,
+                         'peak_rss': steps.get(step)}
+    return results
+
+
+def print_results(results):
+    print('%-28s %10s %12s %14s %10s %10s' % ('step', 'seconds', 'pages/s', 'revisions/s', 'MB/s', 'RSS MB'))
+    for step, result in results['steps'].items():
+        rss = result['peak_rss']['self_mb'] if result['peak_rss'] else float('nan')
+        print('%-28s %10.3f %12.1f %14.1f %10.2f %10.0f' % (step, result['seconds'], result['pages_per_s'] or 0,
+                                                            result['revisions_per_s'] or 0, result['mb_per_s'] or 0,
+                                                            rss))
+    print('Peak RSS: %(self_mb).0f MB benchmark, %(children_mb).0f MB largest child' % results['peak_rss'])
+
+
+def compare(results, earlier):
+    print('%-28s %10s %10s %8s' % ('step', 'before s', 'after s', 'change'))
+    for step, result in results['steps'].items():
+        if step not in earlier['steps']:
+            continue
+        before = earlier['steps'][step]['seconds']
+        change = (result['seconds'] - before) / before * 100 if before > 0 else 0.0
+        print('%-28s %10.3f %10.3f %+7.1f%%' % (step, before, result['seconds'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on generated dumps.')
+    add_arguments(parser)
+    parser.add_argument('--format', default='bz2', choices=['bz2', '7z'], help='compression of the dumps')
+    parser.add_argument('--work', default='bench_work', help='working directory, deleted first')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--start-date', default='2001-01-01')
+    parser.add_argument('--processes', type=int, default=1, help='parallel processes of ProcessorResults')
+    parser.add_argument('--no-streaming', dest='streaming', action='store_false',
+                        help='unpack and split the dumps on disk')
+    parser.add_argument('--parser-mode', default='filter', choices=['tree', 'filter'])
+    parser.add_argument('--link-output', default='full', choices=['full', 'delta'])
+    parser.add_argument('--page-workers', type=int, default=1)
+    parser.add_argument('--output-format', default='csv', choices=['csv', 'parquet'])
+    parser.add_argument('--title-ids', action='store_true')
+    parser.add_argument('--compression', default='xz', choices=['xz', 'zstd'])
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    earlier = None
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            earlier = json.load(infile)
+    if os.path.isdir(args.work):
+        shutil.rmtree(args.work)
+    mirror = os.path.abspath(os.path.join(args.work, 'mirror'))
+    timings = Timings()
+    dumps = timings.run('generate', generate, mirror, generator_from(args), args.files, [args.format])
+    os.chdir(args.work)
+    project = create_project(args, mirror)
+    steps = {}
+    start = time.perf_counter()
+    process_files(project, timings, steps)
+    process_results(project, timings, steps)
+    total = time.perf_counter() - start
+
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.cpu_count(),
+               'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+               'dumps': dumps,
+               'total_seconds': total,
+               'steps': report(dumps, timings, steps),
+               'peak_rss': peak_rss()}
+    print_results(results)
+    if earlier is not None:
+        compare(results, earlier)
+    if output is not None:
+        with open(output, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
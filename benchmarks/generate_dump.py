@@ -0,0 +1,254 @@
+"""Deterministic generator of MediaWiki export-0.10 XML dumps for benchmarks.
+
+Run from the repository root:
+
+    python -m benchmarks.generate_dump out --files 2 --pages 1000 --revisions 10 --formats bz2,7z
+
+The same options and seed always give the same dumps. Every page has on average the given number of revisions
+(giant pages have giant-revisions), each revision edits a few parts of the text of the revision before and
+reverts to the revision before that with the revert ratio. The files are named like the history dumps of
+Wikipedia and listed with their md5 in md5.txt, so the output directory can be used as a mirror (see
+Project.add_dump_file_info). 7z files need 7z on the path.
+"""
+import os
+import bz2
+import random
+import hashlib
+import argparse
+import datetime
+import subprocess
+from xml.sax.saxutils import escape
+
+# Title prefix of the namespaces pages are generated in.
+PREFIXES = {'0': '', '1': 'Talk:', '2': 'User:', '3': 'User talk:', '4': 'Wikipedia:', '6': 'File:',
+            '10': 'Template:', '14': 'Category:'}
+
+WORDS = ['the', 'of', 'and', 'in', 'was', 'river', 'city', 'history', 'war', 'music', 'football', 'population',
+         'university', 'century', 'government', 'album', 'species', 'station', 'church', 'election']
+
+START = datetime.datetime(2005, 1, 1)
+
+
+def parse_namespaces(text):
+    # '0=0.7,1=0.1,14=0.2' -> {'0': 0.7, '1': 0.1, '14': 0.2}
+    namespaces = {}
+    for part in text.split(','):
+        ns, share = part.split('=')
+        assert ns in PREFIXES, 'Namespace ' + ns + ' is not one of ' + ', '.join(PREFIXES) + '.'
+        namespaces[ns] = float(share)
+    return namespaces
+
+
+class DumpGenerator(object):
+    """Writes pages of export-0.10 XML with a seeded random generator.
+
+    link_density is the number of links per 1000 characters of text, text_size the average length of a text.
+    Of every revision a share of edit_ratio of the parts of the text (words, links and categories) is changed.
+    """
+    def __init__(self, pages=1000, revisions=10, text_size=5000, link_density=7.0, namespaces=None,
+                 revert_ratio=0.05, giant_pages=0, giant_revisions=5000, edit_ratio=0.05, seed=42):
+        self.pages = pages
+        self.revisions = revisions
+        self.text_size = text_size
+        self.link_density = link_density
+        self.namespaces = namespaces or {'0': 0.7, '1': 0.1, '2': 0.05, '14': 0.15}
+        self.revert_ratio = revert_ratio
+        self.giant_pages = giant_pages
+        self.giant_revisions = giant_revisions
+        self.edit_ratio = edit_ratio
+        self.seed = seed
+
+    # Title of the article with the page id, links and categories point to titles of the first file.
+    @staticmethod
+    def page_title(page_id):
+        return (WORDS[page_id % len(WORDS)] + ' ' + WORDS[page_id // len(WORDS) % len(WORDS)]).capitalize() + ' ' + \
+            str(page_id)
+
+    def title(self, rng):
+        return self.page_title(rng.randint(1, self.pages))
+
+    def part(self, rng):
+        # A link is followed by about 1000 / link_density characters of words on average.
+        choice = rng.random()
+        if choice < 0.03:
+            return '[[Category:' + self.title(rng) + ']]'
+        if choice < 0.05:
+            return '[[File:' + self.title(rng) + '.jpg|thumb|A [[' + self.title(rng) + ']]]]'
+        if choice < 0.25:
+            return '[[' + self.title(rng) + '|' + self.title(rng).lower() + ']]'
+        if choice < 0.3:
+            return '{{cite web |url=http://example.org/' + str(rng.randint(0, 10 ** 6)) + ' |title=' + \
+                   self.title(rng) + '}}'
+        return '[[' + self.title(rng) + ']]'
+
+    def words(self, rng):
+        length = max(1, int(rng.expovariate(self.link_density / 1000.0) / 7))
+        return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+    def text_parts(self, rng, size):
+        parts = []
+        length = 0
+        while length < size:
+            parts.append(self.words(rng))
+            parts.append(self.part(rng))
+            length += len(parts[-2]) + len(parts[-1]) + 2
+        return parts
+
+    # Half of the changes replace a part, the others add parts while the text is shorter than size and remove
+    # parts while it is longer, so the texts of long histories stay around their size.
+    def edit(self, rng, parts, length, size):
+        parts = list(parts)
+        for _ in range(max(1, int(len(parts) * self.edit_ratio))):
+            i = rng.randrange(len(parts))
+            if rng.random() < 0.5:
+                parts[i] = self.part(rng) if i % 2 else self.words(rng)
+            elif length < size or len(parts) < 4:
+                parts[i:i] = [self.words(rng), self.part(rng)]
+            else:
+                del parts[i - i % 2:i - i % 2 + 2]
+        return parts
+
+    def contributor(self, rng):
+        if rng.random() < 0.2:
+            return '        <ip>%d.%d.%d.%d</ip>\n' % tuple(rng.randint(1, 254) for _ in range(4))
+        author = rng.randint(1, max(10, self.pages // 2))
+        return '        <username>Author %d</username>\n        <id>%d</id>\n' % (author, author)
+
+    def write_page(self, out, rng, page_id, rev_id, revisions):
+        ns = rng.choices(list(self.namespaces), weights=list(self.namespaces.values()))[0]
+        out.write('  <page>\n    <title>%s</title>\n    <ns>%s</ns>\n    <id>%d</id>\n' %
+                  (escape(PREFIXES[ns] + self.page_title(page_id)), ns, page_id))
+        timestamp = START + datetime.timedelta(seconds=rng.randint(0, 10 ** 8))
+        size = int(rng.uniform(0.5, 1.5) * self.text_size)
+        history = [self.text_parts(rng, size)]
+        text = ''
+        written = 0
+        for i in range(revisions):
+            if i > 0 and len(history) > 1 and rng.random() < self.revert_ratio:
+                history.append(history[-2])
+            elif i > 0:
+                history.append(self.edit(rng, history[-1], len(text), size))
+            history = history[-2:]
+            text = ' '.join(history[-1])
+            written += len(text)
+            out.write('    <revision>\n      <id>%d</id>\n' % (rev_id + i))
+            if i > 0:
+                out.write('      <parentid>%d</parentid>\n' % (rev_id + i - 1))
+            out.write('      <timestamp>%s</timestamp>\n      <contributor>\n%s      </contributor>\n' %
+                      (timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'), self.contributor(rng)))
+            out.write('      <model>wikitext</model>\n      <format>text/x-wiki</format>\n')
+            out.write('      <text xml:space="preserve" bytes="%d">%s</text>\n' % (len(text), escape(text)))
+            out.write('      <sha1>%s</sha1>\n    </revision>\n' % hashlib.sha1(text.encode('utf-8')).hexdigest())
+            timestamp += datetime.timedelta(seconds=rng.randint(60, 30 * 86400))
+        out.write('  </page>\n')
+        return written
+
+    def write(self, out, first_page_id=1, first_rev_id=1, seed=None):
+        """Writes a dump with the pages of this generator to the text stream out and returns its statistics."""
+        rng = random.Random(self.seed if seed is None else seed)
+        giant = set(rng.sample(range(self.pages), min(self.giant_pages, self.pages)))
+        out.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n')
+        out.write('  <siteinfo>\n    <sitename>Benchmark</sitename>\n    <namespaces>\n')
+        for ns, prefix in PREFIXES.items():
+            out.write('      <namespace key="%s" case="first-letter">%s</namespace>\n' % (ns, prefix[:-1]))
+        out.write('    </namespaces>\n  </siteinfo>\n')
+        stats = {'pages': 0, 'revisions': 0, 'text_bytes': 0}
+        rev_id = first_rev_id
+        for i in range(self.pages):
+            if i in giant:
+                revisions = self.giant_revisions
+            else:
+                revisions = rng.randint(1, 2 * self.revisions - 1)
+            stats['text_bytes'] += self.write_page(out, rng, first_page_id + i, rev_id, revisions)
+            stats['pages'] += 1
+            stats['revisions'] += revisions
+            rev_id += revisions
+        out.write('</mediawiki>\n')
+        stats['last_rev_id'] = rev_id - 1
+        return stats
+
+
+def md5(path):
+    hash_md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def generate(path, generator, files=1, formats=('bz2',), name='benchwiki-20200101-pages-meta-history'):
+    """Writes files dumps of generator to path in each of the formats ('bz2', '7z' or 'xml') and md5.txt.
+    Returns a list with the name, format, sizes and statistics of every file.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    results = []
+    rev_id = 1
+    for i in range(files):
+        first = i * generator.pages + 1
+        xml_name = '%s%d.xml-p%dp%d' % (name, i + 1, first, first + generator.pages - 1)
+        xml_file = os.path.join(path, xml_name)
+        with open(xml_file, 'w', encoding='utf-8', buffering=8388608) as out:
+            stats = generator.write(out, first, rev_id, seed=generator.seed + i)
+        rev_id = stats.pop('last_rev_id') + 1
+        stats['xml_bytes'] = os.path.getsize(xml_file)
+        for output_format in formats:
+            if output_format == 'bz2':
+                archive = xml_file + '.bz2'
+                with open(xml_file, 'rb') as infile, bz2.open(archive, 'wb') as outfile:
+                    for chunk in iter(lambda: infile.read(16777216), b''):
+                        outfile.write(chunk)
+            elif output_format == '7z':
+                archive = xml_file + '.7z'
+                if os.path.isfile(archive):
+                    os.remove(archive)
+                try:
+                    subprocess.check_call(['7z', 'a', archive, xml_file], stdout=subprocess.DEVNULL)
+                except OSError:
+                    print('7z is not installed, no 7z dumps are generated.')
+                    continue
+            else:
+                archive = xml_file
+            results.append(dict(stats, name=os.path.basename(archive), format=output_format,
+                                bytes=os.path.getsize(archive), md5=md5(archive)))
+        if 'xml' not in formats:
+            os.remove(xml_file)
+    with open(os.path.join(path, 'md5.txt'), 'w') as outfile:
+        for f in results:
+            outfile.write(f['md5'] + '  ' + f['name'] + '\n')
+    return results
+
+
+def add_arguments(parser):
+    parser.add_argument('--files', type=int, default=2, help='number of dump files')
+    parser.add_argument('--pages', type=int, default=1000, help='pages per file')
+    parser.add_argument('--revisions', type=int, default=10, help='average revisions per page')
+    parser.add_argument('--text-size', type=int, default=5000, help='average characters per text')
+    parser.add_argument('--link-density', type=float, default=7.0, help='links per 1000 characters')
+    parser.add_argument('--namespaces', type=parse_namespaces, default=None,
+                        help='namespace shares, e.g. 0=0.7,1=0.1,14=0.2')
+    parser.add_argument('--revert-ratio', type=float, default=0.05, help='share of revisions that are reverts')
+    parser.add_argument('--giant-pages', type=int, default=0, help='pages per file with giant-revisions revisions')
+    parser.add_argument('--giant-revisions', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def generator_from(args):
+    return DumpGenerator(pages=args.pages, revisions=args.revisions, text_size=args.text_size,
+                         link_density=args.link_density, namespaces=args.namespaces, revert_ratio=args.revert_ratio,
+                         giant_pages=args.giant_pages, giant_revisions=args.giant_revisions, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate deterministic export-0.10 XML dumps.')
+    parser.add_argument('path', help='output directory')
+    add_arguments(parser)
+    parser.add_argument('--formats', default='bz2', help='comma separated: bz2, 7z, xml')
+    args = parser.parse_args()
+    for f in generate(args.path, generator_from(args), args.files, args.formats.split(',')):
+        print('%-60s %8d pages %10d revisions %8.1f MB XML' % (f['name'], f['pages'], f['revisions'],
+                                                                f['xml_bytes'] / 1048576.0))
+
+
+if __name__ == '__main__':
+    main()
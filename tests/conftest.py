@@ -0,0 +1,72 @@
+import os
+import bz2
+import itertools
+import pytest
+from benchmarks.generate_dump import DumpGenerator, generate
+from wikiDumpParser.processorData import Processor
+from wikiDumpParser.resultCodec import find_results, open_results
+
+
+@pytest.fixture(scope='session')
+def mirror(tmp_path_factory):
+    """A mirror with one small generated bz2 dump. A third of the revisions revert to the text before."""
+    path = str(tmp_path_factory.mktemp('mirror'))
+    dumps = generate(path, DumpGenerator(pages=60, revisions=8, text_size=1000, revert_ratio=0.3, seed=7), 1,
+                     ['bz2'])
+    return path, dumps[0]
+
+
+def process_dump(mirror, path, **options):
+    """Downloads, parses and postprocesses the dump of mirror into path, returns the results folder."""
+    base_url, dump = mirror
+    processor = Processor(dump['name'], str(path), base_url, 'init', 0, dump['md5'], **options)
+    assert processor.download_dump_file()
+    processor.split()
+    processor.parse()
+    processor.postprocessing_cat_link()
+    return os.path.join(str(path), 'results', os.path.splitext(dump['name'])[0])
+
+
+def revisions_in_dump(mirror):
+    """Page id, revision id, categories and links of every revision of the parsed namespaces, from the XML."""
+    base_url, dump = mirror
+    processor = Processor(dump['name'], os.path.join(base_url, 'reference'), base_url, 'split', 0, dump['md5'])
+    revisions = []
+    for page in processor.iter_pages(bz2.open(os.path.join(base_url, dump['name']), 'rb'), 'filter'):
+        for revision in page['revisions']:
+            cats, links = Processor.links(revision['text'])
+            revisions.append((page['id'], revision['id'], set(cats), set(links)))
+    return revisions
+
+
+def read_rows(results_path, f):
+    """(page_id, rev_id, target) of a results file, compressed or not."""
+    results_file = find_results(results_path, f)
+    if results_file is None:
+        return []
+    with open_results(results_file, 'rt') as infile:
+        return [tuple(line.rstrip('\n').split('\t', 2)) for line in infile]
+
+
+def grouped(rows):
+    """(page_id, rev_id, set of targets) of rows in file order."""
+    return [(key[0], key[1], set(row[2] for row in group))
+            for key, group in itertools.groupby(rows, key=lambda row: (row[0], row[1]))]
+
+
+def states(revisions):
+    """The targets of every page after each revision in revisions (page_id, rev_id, targets), by page and revision.
+    Returns a function of page_id and rev_id giving the targets after the last revision up to rev_id.
+    """
+    pages = {}
+    for page_id, rev_id, targets in revisions:
+        pages.setdefault(page_id, []).append((int(rev_id), set(targets)))
+
+    def at(page_id, rev_id):
+        current = set()
+        for revision, targets in pages.get(page_id, []):
+            if revision > int(rev_id):
+                break
+            current = targets
+        return current
+    return at
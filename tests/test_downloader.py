@@ -0,0 +1,93 @@
+import os
+import pytest
+from wikiDumpParser.downloader import Downloader, FileSource, source_for
+
+
+class RecordingSource(FileSource):
+    """FileSource that records the byte ranges read and fails after fail_after chunks of one range."""
+    def __init__(self, base_url, fail_after=None, fail_start=0):
+        FileSource.__init__(self, base_url)
+        self.fail_after = fail_after
+        self.fail_start = fail_start
+        self.reads = []
+        self.bytes = 0
+
+    def read(self, name, start=0, end=None, chunk_size=1048576):
+        self.reads.append((start, end))
+        for i, chunk in enumerate(FileSource.read(self, name, start, end, chunk_size)):
+            if self.fail_after is not None and start == self.fail_start and i == self.fail_after:
+                raise IOError('connection reset')
+            self.bytes += len(chunk)
+            yield chunk
+
+
+def content(mirror):
+    base_url, dump = mirror
+    with open(os.path.join(base_url, dump['name']), 'rb') as infile:
+        return infile.read()
+
+
+def test_file_url_selects_file_source(mirror):
+    base_url, dump = mirror
+    assert isinstance(source_for('file://' + base_url), FileSource)
+    assert source_for('file://' + base_url).size(dump['name']) == (dump['bytes'], True)
+
+
+def test_download_verifies_md5(mirror, tmp_path):
+    base_url, dump = mirror
+    path = str(tmp_path / dump['name'])
+    downloader = Downloader(source_for('file://' + base_url), chunk_size=4096)
+    assert not downloader.download(dump['name'], path, 'wrong')
+    assert not os.path.exists(path) and not os.path.exists(path + '.part')
+    assert downloader.download(dump['name'], path, dump['md5'])
+    with open(path, 'rb') as infile:
+        assert infile.read() == content(mirror)
+
+
+def test_interrupted_download_resumes(mirror, tmp_path):
+    base_url, dump = mirror
+    path = str(tmp_path / dump['name'])
+    failing = RecordingSource(base_url, fail_after=3)
+    with pytest.raises(IOError):
+        Downloader(failing, chunk_size=4096).download(dump['name'], path, dump['md5'])
+    assert os.path.getsize(path + '.part') == 3 * 4096
+
+    source = RecordingSource(base_url)
+    assert Downloader(source, chunk_size=4096).download(dump['name'], path, dump['md5'])
+    # Only the missing bytes are read again.
+    assert source.reads == [(3 * 4096, None)]
+    assert source.bytes == dump['bytes'] - 3 * 4096
+    with open(path, 'rb') as infile:
+        assert infile.read() == content(mirror)
+
+
+def test_segmented_download(mirror, tmp_path):
+    base_url, dump = mirror
+    path = str(tmp_path / dump['name'])
+    downloader = Downloader(RecordingSource(base_url), segments=4, segment_size=dump['bytes'] // 5, chunk_size=1024)
+    assert downloader.download(dump['name'], path, dump['md5'])
+    assert len(downloader.source.reads) == 4
+    assert not os.path.exists(path + '.part.progress')
+    with open(path, 'rb') as infile:
+        assert infile.read() == content(mirror)
+
+
+def test_interrupted_segmented_download_resumes(mirror, tmp_path):
+    base_url, dump = mirror
+    path = str(tmp_path / dump['name'])
+    segment_size = dump['bytes'] // 5
+    bounds = Downloader(None, segments=4, segment_size=segment_size).segment_bounds(dump['bytes'])
+    # The second segment fails after two chunks, the others complete.
+    failing = RecordingSource(base_url, fail_after=2, fail_start=bounds[1][0])
+    with pytest.raises(IOError):
+        Downloader(failing, segments=4, segment_size=segment_size, chunk_size=1024).download(dump['name'], path,
+                                                                                           dump['md5'])
+    assert os.path.isfile(path + '.part.progress')
+
+    source = RecordingSource(base_url)
+    assert Downloader(source, segments=4, segment_size=segment_size, chunk_size=1024).download(dump['name'], path,
+                                                                                             dump['md5'])
+    assert source.reads == [(bounds[1][0] + 2 * 1024, bounds[1][1] - 1)]
+    assert not os.path.exists(path + '.part.progress')
+    with open(path, 'rb') as infile:
+        assert infile.read() == content(mirror)
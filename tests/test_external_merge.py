@@ -0,0 +1,30 @@
+import os
+import random
+from wikiDumpParser.externalMerge import ExternalMerge, link_key, revision_key
+
+
+def test_merge_sorts_and_drops_duplicates_over_many_runs(tmp_path):
+    rng = random.Random(3)
+    rows = [(rng.randint(1, 50), rng.randint(1, 500), 'Title %d' % rng.randint(1, 20)) for _ in range(3000)]
+    lines = ['%d\t%d\t%s\n' % row for row in rows]
+    results = str(tmp_path / 'links.csv')
+    # A few hundred bytes per run and at most 4 open runs, so runs are merged in several rounds.
+    merge = ExternalMerge(results, link_key, lambda line: line, memory=5000, max_open=4)
+    merge.add(lines[:1500])
+    merge.add(lines[1500:])
+    assert len(merge.runs) > 4
+    merge.finish()
+    with open(results) as infile:
+        merged = infile.readlines()
+    assert merged == sorted(set(lines), key=link_key)
+    assert not os.path.exists(results + '.runs')
+
+
+def test_merge_keeps_the_line_of_the_first_input(tmp_path):
+    results = str(tmp_path / 'revisions.csv')
+    merge = ExternalMerge(results, revision_key, revision_key, memory=100)
+    merge.add(['1\t%d\told\n' % rev_id for rev_id in (5, 3, 9)])
+    merge.add(['1\t%d\tnew\n' % rev_id for rev_id in (4, 3, 9, 1)])
+    merge.finish()
+    with open(results) as infile:
+        assert infile.read() == '1\t1\tnew\n1\t3\told\n1\t4\tnew\n1\t5\told\n1\t9\told\n'
@@ -0,0 +1,49 @@
+import os
+import pytest
+from wikiDumpParser.processorData import Processor
+from wikiDumpParser.resultCodec import find_results
+from conftest import process_dump, revisions_in_dump, read_rows, grouped, states
+
+
+@pytest.fixture(scope='module')
+def results(mirror, tmp_path_factory):
+    full = process_dump(mirror, tmp_path_factory.mktemp('full'), streaming=True, link_output='full')
+    delta = process_dump(mirror, tmp_path_factory.mktemp('delta'), streaming=True, link_output='delta')
+    return full, delta, revisions_in_dump(mirror)
+
+
+@pytest.mark.parametrize('kind', ['cats', 'links'])
+def test_delta_replay_matches_every_revision(results, kind):
+    full, delta, revisions = results
+    replayed = states(Processor.replay_events(find_results(delta, kind + '.csv')))
+    for page_id, rev_id, cats, links in revisions:
+        assert replayed(page_id, rev_id) == (cats if kind == 'cats' else links)
+
+
+@pytest.mark.parametrize('kind', ['cats', 'links'])
+def test_full_output_keeps_changed_revisions(results, kind):
+    full, delta, revisions = results
+    expected = []
+    previous = {}
+    for page_id, rev_id, cats, links in revisions:
+        targets = cats if kind == 'cats' else links
+        # Revisions without targets have no rows, so the next one is compared with the last one that had.
+        if targets and targets != previous.get(page_id):
+            expected.append((page_id, rev_id, targets))
+            previous[page_id] = targets
+    assert grouped(read_rows(full, kind + '.csv')) == expected
+
+
+@pytest.mark.parametrize('kind', ['cats', 'links'])
+def test_delta_replay_matches_full_output(results, kind):
+    full, delta, revisions = results
+    replayed = states(Processor.replay_events(find_results(delta, kind + '.csv')))
+    kept = grouped(read_rows(full, kind + '.csv'))
+    assert kept
+    for page_id, rev_id, targets in kept:
+        assert replayed(page_id, rev_id) == targets
+
+
+def test_delta_output_has_fewer_rows(results):
+    full, delta, revisions = results
+    assert os.path.getsize(find_results(delta, 'links.csv')) < os.path.getsize(find_results(full, 'links.csv'))
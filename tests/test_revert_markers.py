@@ -0,0 +1,74 @@
+import os
+import pytest
+from wikiDumpParser.processorData import Processor, RevertMarkers
+from conftest import process_dump, revisions_in_dump, read_rows, grouped, states
+
+
+def write_lines(path, rows):
+    with open(path, 'w') as outfile:
+        for row in rows:
+            outfile.write('\t'.join(str(field) for field in row) + '\n')
+
+
+def test_revision_after_a_revert_is_compared_with_the_reverted_to_revision(tmp_path):
+    links = str(tmp_path / 'links.csv')
+    reverts = str(tmp_path / 'reverts.csv')
+    write_lines(links, [(1, 10, 'A'), (1, 11, 'B'), (1, 13, 'B'), (1, 14, 'B'), (1, 16, 'B'), (1, 17, 'C'),
+                        (2, 20, 'A'), (2, 22, 'B'), (2, 24, 'A'), (2, 25, 'B')])
+    # Page 2 comes first: the markers do not need to be in page order. Revision 21 has no rows, it had the
+    # targets of revision 20.
+    write_lines(reverts, [(2, 23, 21), (1, 12, 10), (1, 15, 13)])
+    output = Processor.remove_unchanged_revisions(links, str(tmp_path / 'unique.csv'), reverts)
+    with open(output) as infile:
+        kept = [tuple(line.rstrip('\n').split('\t')) for line in infile]
+    assert kept == [('1', '10', 'A'), ('1', '11', 'B'), ('1', '13', 'B'), ('1', '17', 'C'),
+                    ('2', '20', 'A'), ('2', '22', 'B'), ('2', '25', 'B')]
+
+
+def test_markers_are_found_in_any_page_order(tmp_path):
+    reverts = str(tmp_path / 'reverts.csv')
+    write_lines(reverts, [(5, 52, 50), (3, 31, 30), (5, 51, 50), (4, 40, 39)])
+    markers = RevertMarkers(reverts)
+    assert markers.page(5) == [(51, 50), (52, 50)]
+    assert markers.page(3) == [(31, 30)]
+    assert markers.page(4) == [(40, 39)]
+    assert markers.page(6) == []
+
+
+@pytest.fixture(scope='module')
+def results(mirror, tmp_path_factory):
+    # Split files on disk, in the default mode.
+    markers = process_dump(mirror, tmp_path_factory.mktemp('markers'), revert_markers=True)
+    plain = process_dump(mirror, tmp_path_factory.mktemp('plain'), streaming=True)
+    return markers, plain, revisions_in_dump(mirror)
+
+
+@pytest.mark.parametrize('kind', ['cats', 'links'])
+def test_markers_keep_the_targets_of_every_revision(results, kind):
+    markers, plain, revisions = results
+    reverts = os.path.join(markers, 'reverts.csv')
+    assert os.path.getsize(reverts) > 0
+    replayed = list(Processor.replay_reverts(grouped(read_rows(markers, kind + '.csv')), RevertMarkers(reverts)))
+    at = states((page_id, rev_id, targets) for page_id, rev_id, targets, marker in replayed)
+    for page_id, rev_id, cats, links in revisions:
+        targets = cats if kind == 'cats' else links
+        # Revisions without targets have no rows, whatever the page had before remains.
+        if targets:
+            assert at(page_id, rev_id) == targets
+
+
+@pytest.mark.parametrize('kind', ['cats', 'links'])
+def test_markers_leave_no_unchanged_revisions(results, kind):
+    markers, plain, revisions = results
+    replayed = Processor.replay_reverts(grouped(read_rows(markers, kind + '.csv')),
+                                        RevertMarkers(os.path.join(markers, 'reverts.csv')))
+    previous = {}
+    for page_id, rev_id, targets, marker in replayed:
+        if not marker:
+            assert set(targets) != previous.get(page_id)
+        previous[page_id] = set(targets)
+
+
+def test_markers_replace_the_rows_of_reverts(results):
+    markers, plain, revisions = results
+    assert len(read_rows(markers, 'links.csv')) < len(read_rows(plain, 'links.csv'))
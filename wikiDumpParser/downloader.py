@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import threading
+import requests
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+
+class HttpSource(object):
+    """Dump files served over HTTP(S). Byte ranges are requested with Range headers."""
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def size(self, name):
+        response = requests.head(self.base_url + name, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        ranges = response.headers.get('Accept-Ranges', '') == 'bytes'
+        length = response.headers.get('Content-Length')
+        return (int(length) if length is not None else None), ranges
+
+    # Yields the bytes from start up to and including end (None for the end of the file).
+    def read(self, name, start=0, end=None, chunk_size=1048576):
+        headers = {}
+        if start > 0 or end is not None:
+            headers['Range'] = 'bytes=%d-%s' % (start, '' if end is None else str(end))
+        response = requests.get(self.base_url + name, headers=headers, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        if headers and response.status_code != 206:
+            response.close()
+            raise IOError('Server does not support range requests for ' + name)
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+        finally:
+            response.close()
+
+
+class FileSource(object):
+    """Dump files in a local directory or mirror, given as a file:// URL or a path."""
+    def __init__(self, base_url):
+        if base_url.startswith('file://'):
+            base_url = url2pathname(urlparse(base_url).path)
+        self.path = base_url
+
+    def size(self, name):
+        return os.path.getsize(os.path.join(self.path, name)), True
+
+    def read(self, name, start=0, end=None, chunk_size=1048576):
+        with open(os.path.join(self.path, name), 'rb') as infile:
+            infile.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = infile.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+def source_for(base_url):
+    if base_url.startswith('file://') or os.path.isdir(base_url):
+        return FileSource(base_url)
+    return HttpSource(base_url)
+
+
+class Downloader(object):
+    """Downloads dump files from a source (HttpSource, FileSource or anything with size() and read()).
+
+    Data is written to <path>.part and only renamed to path once the md5 matches. The md5 is computed
+    from the bytes as they are written, so there is no second pass over the file. An interrupted download
+    continues where it stopped; only the bytes already on disk are read again to restore the md5.
+    Files of at least two segment_size are fetched in parallel byte ranges if segments is larger than 1.
+    """
+    def __init__(self, source, segments=1, segment_size=268435456, chunk_size=1048576):
+        self.source = source
+        self.segments = segments
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+
+    def download(self, name, path, md5=None):
+        part = path + '.part'
+        size, ranges = self.source.size(name)
+        if self.segments > 1 and ranges and size is not None and size >= 2 * self.segment_size:
+            hash_md5 = self.download_segments(name, part, size)
+        else:
+            hash_md5 = self.download_stream(name, part, size if ranges else None)
+        if md5 is not None and hash_md5.hexdigest() != md5:
+            os.remove(part)
+            return False
+        os.rename(part, path)
+        return True
+
+    def download_stream(self, name, part, size):
+        hash_md5 = hashlib.md5()
+        offset = 0
+        if os.path.isfile(part):
+            offset = os.path.getsize(part)
+            if size is None or offset > size:
+                offset = 0
+        if offset > 0:
+            with open(part, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(self.chunk_size), b''):
+                    hash_md5.update(chunk)
+        with open(part, 'ab' if offset > 0 else 'wb') as handle:
+            if offset == size:
+                return hash_md5
+            for chunk in self.source.read(name, offset, None, self.chunk_size):
+                handle.write(chunk)
+                hash_md5.update(chunk)
+        return hash_md5
+
+    def segment_bounds(self, size):
+        count = min(self.segments, size // self.segment_size)
+        step = size // count
+        return [(i * step, size if i == count - 1 else (i + 1) * step) for i in range(count)]
+
+    # The segments are written into the preallocated part file by one thread each. This thread hashes
+    # the file in order, right behind the writer of the segment it has reached. The bytes done per
+    # segment are kept in <part>.progress so an interrupted download can be resumed.
+    def download_segments(self, name, part, size):
+        bounds = self.segment_bounds(size)
+        progress_file = part + '.progress'
+        done = [0] * len(bounds)
+        if os.path.isfile(part) and os.path.isfile(progress_file):
+            with open(progress_file, 'r') as infile:
+                saved = json.load(infile)
+            if saved['size'] == size and len(saved['done']) == len(bounds):
+                done = saved['done']
+        fd = os.open(part, os.O_RDWR | os.O_CREAT)
+        condition = threading.Condition()
+        errors = []
+
+        def fetch(i):
+            start, end = bounds[i]
+            position = start + done[i]
+            try:
+                if position < end:
+                    for chunk in self.source.read(name, position, end - 1, self.chunk_size):
+                        os.pwrite(fd, chunk, position)
+                        position += len(chunk)
+                        with condition:
+                            done[i] = position - start
+                            condition.notify_all()
+            except Exception as e:
+                with condition:
+                    errors.append(e)
+                    condition.notify_all()
+
+        def save_progress():
+            with open(progress_file, 'w') as outfile:
+                json.dump({'size': size, 'done': done}, outfile)
+
+        try:
+            os.ftruncate(fd, size)
+            threads = [threading.Thread(target=fetch, args=(i,)) for i in range(len(bounds))]
+            for thread in threads:
+                thread.start()
+            hash_md5 = hashlib.md5()
+            hashed = 0
+            segment = 0
+            saved_at = 0
+            while segment < len(bounds):
+                start, end = bounds[segment]
+                with condition:
+                    while start + done[segment] <= hashed and not errors:
+                        if not any(thread.is_alive() for thread in threads):
+                            break
+                        condition.wait(1)
+                    available = start + done[segment]
+                if errors or available <= hashed:
+                    for thread in threads:
+                        thread.join()
+                    raise IOError('Download of ' + name + ' failed: ' + (str(errors[0]) if errors else 'incomplete'))
+                while hashed < available:
+                    chunk = os.pread(fd, min(self.chunk_size, available - hashed), hashed)
+                    hash_md5.update(chunk)
+                    hashed += len(chunk)
+                if hashed == end:
+                    segment += 1
+                if hashed - saved_at >= 67108864:
+                    save_progress()
+                    saved_at = hashed
+            for thread in threads:
+                thread.join()
+        except Exception:
+            save_progress()
+            raise
+        finally:
+            os.close(fd)
+        if os.path.isfile(progress_file):
+            os.remove(progress_file)
+        return hash_md5
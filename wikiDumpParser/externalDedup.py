@@ -0,0 +1,86 @@
+import os
+import shutil
+import zlib
+import multiprocessing
+import pandas as pd
+from wikiDumpParser.parquetOutput import *
+
+
+def bucket_of(line, buckets):
+    # crc32 instead of hash(), which differs between processes.
+    return zlib.crc32(line) % buckets
+
+
+def dedup_bucket(bucket_file):
+    with open(bucket_file, 'rb') as infile:
+        lines = dict.fromkeys(infile)
+    with open(bucket_file + '.unique', 'wb') as outfile:
+        outfile.writelines(lines)
+    os.remove(bucket_file)
+    return bucket_file + '.unique'
+
+
+def dedup_parquet_bucket(bucket_file, name):
+    frames = list(iter_frames(bucket_file))
+    with ParquetTableWriter(bucket_file + '.unique', name) as writer:
+        if frames:
+            writer.write_frame(pd.concat(frames).drop_duplicates())
+    os.remove(bucket_file)
+    return bucket_file + '.unique'
+
+
+def dedup_lines(files, path, buckets=64, processes=1):
+    """Writes the distinct lines of the files to path without holding all of them in memory.
+
+    Every line is spilled to one of the bucket files by its hash, so equal lines end up in the same bucket.
+    The buckets are deduplicated in parallel, each in memory, and concatenated. Rows of tab separated
+    results are written with the same quoting every time, so equal rows are equal lines.
+    """
+    bucket_path = path + '.buckets'
+    if os.path.isdir(bucket_path):
+        shutil.rmtree(bucket_path)
+    os.makedirs(bucket_path)
+    bucket_files = [os.path.join(bucket_path, str(i)) for i in range(buckets)]
+    outputs = [open(f, 'wb', buffering=1048576) for f in bucket_files]
+    try:
+        for f in files:
+            with open(f, 'rb') as infile:
+                for line in infile:
+                    if not line.endswith(b'\n'):
+                        line += b'\n'
+                    outputs[bucket_of(line, buckets)].write(line)
+    finally:
+        for output in outputs:
+            output.close()
+    with multiprocessing.Pool(processes) as pool:
+        unique_files = pool.map(dedup_bucket, bucket_files)
+    with open(path, 'wb') as outfile:
+        for f in unique_files:
+            with open(f, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile, 16777216)
+    shutil.rmtree(bucket_path)
+
+
+def dedup_parquet(files, path, name, buckets=64, processes=1):
+    """Same as dedup_lines for Parquet files of the result name: rows are spread over bucket files by
+    the hash of the row, the buckets deduplicated in parallel and their row groups concatenated.
+    """
+    bucket_path = path + '.buckets'
+    if os.path.isdir(bucket_path):
+        shutil.rmtree(bucket_path)
+    os.makedirs(bucket_path)
+    bucket_files = [os.path.join(bucket_path, str(i)) for i in range(buckets)]
+    writers = [ParquetTableWriter(f, name) for f in bucket_files]
+    try:
+        for f in files:
+            for frame in iter_frames(f):
+                keys = pd.util.hash_pandas_object(frame, index=False).to_numpy() % buckets
+                for i, rows in frame.groupby(keys):
+                    writers[i].write_frame(rows)
+    finally:
+        for writer in writers:
+            writer.close()
+    with multiprocessing.Pool(processes) as pool:
+        unique_files = pool.starmap(dedup_parquet_bucket, [(f, name) for f in bucket_files])
+    concat_files(unique_files, path, name)
+    shutil.rmtree(bucket_path)
@@ -0,0 +1,92 @@
+import os
+import heapq
+import shutil
+from wikiDumpParser.resultCodec import read_lines
+
+
+# Keys of the tab separated results: leading id columns compare as numbers.
+def link_key(line):
+    fields = line.split('\t', 2)
+    return int(fields[0]), int(fields[1]), fields[2]
+
+
+def revision_key(line):
+    return int(line.split('\t', 2)[1])
+
+
+def page_key(line):
+    return int(line.split('\t', 1)[0])
+
+
+class ExternalMerge(object):
+    """Sorts the lines of any number of inputs by key and merges them into one file in a single pass.
+
+    Lines are collected until about memory bytes are held, sorted and written to a run file. finish()
+    merges the runs with heapq.merge (at most max_open at a time) and drops every line whose dedup key
+    equals the one of the line before. Equal keys keep the order of the inputs, so of duplicates the line
+    of the input added first is kept.
+    """
+    def __init__(self, path, key, dedup_key=None, memory=1073741824, max_open=256):
+        self.path = path
+        self.key = key
+        self.dedup_key = dedup_key
+        self.memory = memory
+        self.max_open = max_open
+        self.tmp_path = path + '.runs'
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.runs = []
+        self.count = 0
+
+    def add(self, lines):
+        buffer = []
+        size = 0
+        for line in lines:
+            buffer.append(line)
+            # Python keeps roughly 100 bytes per line on top of the text and the key.
+            size += len(line) + 100
+            if size >= self.memory:
+                self.spill(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            self.spill(buffer)
+
+    def run_file(self):
+        self.count += 1
+        return os.path.join(self.tmp_path, str(self.count))
+
+    def spill(self, lines):
+        lines.sort(key=self.key)
+        run = self.run_file()
+        with open(run, 'w', encoding='utf-8', buffering=8388608) as outfile:
+            outfile.writelines(lines)
+        self.runs.append(run)
+
+    def merge(self, runs, path):
+        files = [open(run, 'r', encoding='utf-8', buffering=1048576) for run in runs]
+        try:
+            with open(path, 'w', encoding='utf-8', buffering=8388608) as outfile:
+                last = None
+                for line in heapq.merge(*files, key=self.key):
+                    if self.dedup_key is not None:
+                        current = self.dedup_key(line)
+                        if current == last:
+                            continue
+                        last = current
+                    outfile.write(line)
+        finally:
+            for f in files:
+                f.close()
+        for run in runs:
+            os.remove(run)
+
+    def finish(self):
+        # Consecutive runs are merged first if there are too many to open at once, which keeps the order of inputs.
+        while len(self.runs) > self.max_open:
+            run = self.run_file()
+            self.merge(self.runs[:self.max_open], run)
+            self.runs = [run] + self.runs[self.max_open:]
+        self.merge(self.runs, self.path)
+        shutil.rmtree(self.tmp_path)
@@ -0,0 +1,417 @@
+import os
+import json
+import glob
+import array
+import heapq
+import shutil
+import itertools
+import calendar
+import numpy as np
+import pandas as pd
+from dateutil import parser
+from pyunpack import Archive
+from wikiDumpParser.processorData import Processor, RevertMarkers
+from wikiDumpParser.parquetOutput import pa, iter_tables
+from wikiDumpParser.resultCodec import open_results
+from wikiDumpParser.titleDictionary import title_id
+
+# valid_to of edges that still exist in the last parsed revision of their page.
+OPEN_END = np.iinfo(np.int64).max
+
+PART_COLUMNS = ('nodes', 'counts', 'targets', 'valid_from', 'valid_to')
+
+
+def to_epoch(date):
+    """Seconds since the epoch of a date string, datetime or number. Dates without a time zone are UTC,
+    like the timestamps in the dumps.
+    """
+    if isinstance(date, (int, float, np.integer)):
+        return int(date)
+    if isinstance(date, str):
+        date = parser.parse(date)
+    if date.tzinfo is None:
+        return calendar.timegm(date.timetuple())
+    return int(date.timestamp())
+
+
+class RevisionTimes(object):
+    """Epochs of the processed revisions, kept as two int64 arrays sorted by revision id."""
+    def __init__(self, revisions_file, chunksize=10000000):
+        rev_ids = []
+        epochs = []
+        if revisions_file.endswith('.parquet'):
+            for table in iter_tables(revisions_file, columns=['rev_id', 'timestamp']):
+                rev_ids.append(table['rev_id'].to_numpy())
+                epochs.append(table['timestamp'].cast(pa.timestamp('s', tz='UTC')).cast(pa.int64()).to_numpy())
+        else:
+            for chunk in pd.read_csv(revisions_file, delimiter='\t', header=None, usecols=['rev_id', 'epoch'],
+                                     names=['page_id', 'rev_id', 'ts', 'author_id', 'epoch'], chunksize=chunksize):
+                rev_ids.append(chunk['rev_id'].to_numpy(dtype=np.int64))
+                epochs.append(chunk['epoch'].to_numpy(dtype=np.int64))
+        rev_ids = np.concatenate(rev_ids) if rev_ids else np.zeros(0, dtype=np.int64)
+        epochs = np.concatenate(epochs) if epochs else np.zeros(0, dtype=np.int64)
+        order = np.argsort(rev_ids, kind='stable')
+        self.rev_ids = rev_ids[order]
+        self.epochs = epochs[order]
+
+    def get(self, rev_id):
+        i = np.searchsorted(self.rev_ids, rev_id)
+        if i < len(self.rev_ids) and self.rev_ids[i] == rev_id:
+            return int(self.epochs[i])
+        return None
+
+
+class GraphPart(object):
+    """Edges with validity intervals of one results file, appended to one raw int64 file per column.
+
+    The edges of a page are written together once the page is done, nodes and counts record the pages
+    and their number of edges in file order.
+    """
+    def __init__(self, path, flush_size=1048576):
+        os.makedirs(path)
+        self.path = path
+        self.flush_size = flush_size
+        self.columns = {name: array.array('q') for name in PART_COLUMNS}
+        self.first = None
+        self.last = None
+        self.ordered = True
+        self.pages = 0
+        self.edges = 0
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def add_page(self, page_id, edges):
+        if not edges:
+            return
+        if self.last is not None and page_id <= self.last:
+            self.ordered = False
+        if self.first is None:
+            self.first = page_id
+        self.last = page_id
+        self.columns['nodes'].append(page_id)
+        self.columns['counts'].append(len(edges))
+        for target, valid_from, valid_to in edges:
+            self.columns['targets'].append(target)
+            self.columns['valid_from'].append(valid_from)
+            self.columns['valid_to'].append(valid_to)
+        self.pages += 1
+        self.edges += len(edges)
+        if len(self.columns['targets']) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        for name, values in self.columns.items():
+            with open(self.file(name), 'ab') as outfile:
+                values.tofile(outfile)
+            del values[:]
+
+    def load(self, name):
+        if not os.path.isfile(self.file(name)) or os.path.getsize(self.file(name)) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(self.file(name), dtype=np.int64, mode='r')
+
+    # Rewrites the columns in page order (pages with the same id keep their order). Only the pages are held in
+    # memory, the edges are gathered from the memory mapped columns chunk_size edges at a time.
+    def sort(self, chunk_size=16777216):
+        if self.ordered:
+            return
+        nodes = np.array(self.load('nodes'))
+        counts = np.array(self.load('counts'))
+        starts = np.cumsum(counts) - counts
+        order = np.argsort(nodes, kind='stable')
+        lengths = counts[order]
+        ends = np.cumsum(lengths)
+        for name in ('targets', 'valid_from', 'valid_to'):
+            values = self.load(name)
+            with open(self.file(name + '.sorted'), 'wb') as outfile:
+                first = 0
+                while first < len(order):
+                    last = max(first + 1, int(np.searchsorted(ends, ends[first] - lengths[first] + chunk_size,
+                                                              side='right')))
+                    sizes = lengths[first:last]
+                    index = np.repeat(starts[order[first:last]] - (np.cumsum(sizes) - sizes), sizes) + \
+                        np.arange(sizes.sum(), dtype=np.int64)
+                    values[index].tofile(outfile)
+                    first = last
+            del values
+            os.replace(self.file(name + '.sorted'), self.file(name))
+        for name, values in (('nodes', nodes[order]), ('counts', lengths)):
+            with open(self.file(name), 'wb') as outfile:
+                values.tofile(outfile)
+        self.first = int(nodes[order[0]])
+        self.last = int(nodes[order[-1]])
+        self.ordered = True
+
+    # Yields page_id, part number and number of edges of every page, in file order.
+    def iter_pages(self, number, chunk_size=1048576):
+        nodes = self.load('nodes')
+        counts = self.load('counts')
+        for start in range(0, self.pages, chunk_size):
+            for page_id, count in zip(nodes[start:start + chunk_size].tolist(),
+                                      counts[start:start + chunk_size].tolist()):
+                yield page_id, number, count
+
+
+class GraphBuilder(object):
+    """Turns links or categories into a graph on disk in CSR form, with the interval each edge is valid in.
+
+    The targets of a revision are valid from its timestamp until the timestamp of the next revision of the
+    page in the results file that does not have them anymore. Results of link_output 'full' only contain
+    revisions with at least one target, so targets of a page whose last link was removed remain valid in
+    these results; events of link_output 'delta' also record that.
+
+    The graph consists of nodes (source page ids, sorted), offsets (the edges of nodes[i] are
+    offsets[i]:offsets[i+1]), targets (title ids, see titleDictionary), valid_from and valid_to (epochs,
+    valid_from <= t < valid_to), each an .npy file that can be memory mapped.
+
+    Revisions recorded as revert markers (reverts.csv of set_revert_markers) have the targets of the revision
+    they reverted to.
+    """
+    def __init__(self, path, times, title_ids=False, delta=False, revert_file=None):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.times = times
+        self.title_ids = title_ids
+        self.delta = delta
+        self.reverts = RevertMarkers(revert_file) if revert_file is not None else None
+        self.parts = []
+
+    def target_id(self, target):
+        return int(target) if self.title_ids else title_id(target)
+
+    # Yields page_id, rev_id and the set of target ids of every revision in a results file.
+    def revisions(self, results_file):
+        if self.delta:
+            for page_id, rev_id, targets in Processor.replay_events(results_file):
+                yield int(page_id), int(rev_id), set(self.target_id(target) for target in targets)
+            return
+        if self.reverts is not None:
+            for page_id, rev_id, targets, marker in Processor.replay_reverts(self.revision_targets(results_file),
+                                                                             self.reverts):
+                yield page_id, rev_id, targets
+            return
+        for revision in self.revision_targets(results_file):
+            yield revision
+
+    def revision_targets(self, results_file):
+        key = None
+        targets = set()
+        for page_id, rev_id, target in self.rows(results_file):
+            if (page_id, rev_id) != key:
+                if key is not None:
+                    yield key[0], key[1], targets
+                key = (page_id, rev_id)
+                targets = set()
+            targets.add(target)
+        if key is not None:
+            yield key[0], key[1], targets
+
+    def rows(self, results_file):
+        if results_file.endswith('.parquet'):
+            for table in iter_tables(results_file):
+                if 'target_id' in table.column_names:
+                    targets = table['target_id'].to_pylist()
+                else:
+                    targets = [title_id(target) for target in table['target'].to_pylist()]
+                for row in zip(table['page_id'].to_pylist(), table['rev_id'].to_pylist(), targets):
+                    yield row
+            return
+        with open_results(results_file, 'rt') as infile:
+            for line in infile:
+                fields = line.rstrip('\n').split('\t', 2)
+                if len(fields) == 3 and fields[2]:
+                    yield int(fields[0]), int(fields[1]), self.target_id(fields[2])
+
+    def add_file(self, results_file):
+        unpacked = None
+        if results_file.endswith('.7z'):
+            unpacked = os.path.join(self.tmp_path, 'unpacked')
+            Archive(results_file).extractall(unpacked, auto_create_dir=True)
+            results_file = glob.glob(os.path.join(unpacked, '*'))[0]
+        part = GraphPart(os.path.join(self.tmp_path, str(len(self.parts))))
+        page_id = None
+        valid = {}
+        edges = []
+        for page, rev_id, targets in self.revisions(results_file):
+            epoch = self.times.get(rev_id)
+            if epoch is None:
+                continue
+            if page != page_id:
+                part.add_page(page_id, edges + [(target, start, OPEN_END) for target, start in valid.items()])
+                page_id = page
+                valid = {}
+                edges = []
+            for target in [target for target in valid if target not in targets]:
+                edges.append((target, valid.pop(target), epoch))
+            for target in targets:
+                if target not in valid:
+                    valid[target] = epoch
+        part.add_page(page_id, edges + [(target, start, OPEN_END) for target, start in valid.items()])
+        part.flush()
+        self.parts.append(part)
+        if unpacked is not None:
+            shutil.rmtree(unpacked)
+
+    def finish(self, chunk_size=16777216):
+        parts = [part for part in self.parts if part.pages > 0]
+        for part in parts:
+            part.sort(chunk_size)
+        ordered = sorted(parts, key=lambda part: part.first)
+        nodes = sum(part.pages for part in parts)
+        edges = sum(part.edges for part in parts)
+        outputs = {'nodes': self.output('nodes', nodes), 'offsets': self.output('offsets', nodes + 1)}
+        for name in ('targets', 'valid_from', 'valid_to'):
+            outputs[name] = self.output(name, edges)
+        if all(a.last < b.first for a, b in zip(ordered, ordered[1:])):
+            self.concatenate(ordered, outputs, chunk_size)
+        else:
+            self.merge(parts, outputs, chunk_size)
+        for output in outputs.values():
+            if isinstance(output, np.memmap):
+                output.flush()
+        del outputs
+        with open(os.path.join(self.tmp_path, 'graph.json'), 'w') as outfile:
+            json.dump({'nodes': nodes, 'edges': edges}, outfile)
+        for part in self.parts:
+            shutil.rmtree(part.path)
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp_path, self.path)
+
+    def output(self, name, size):
+        path = os.path.join(self.tmp_path, name + '.npy')
+        if size == 0:
+            np.save(path, np.zeros(0, dtype=np.int64))
+            return np.zeros(0, dtype=np.int64)
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.int64, shape=(size,))
+
+    # Pages are already sorted over all parts, their columns are copied one after the other.
+    @staticmethod
+    def concatenate(parts, outputs, chunk_size):
+        node = 0
+        edge = 0
+        outputs['offsets'][0] = 0
+        for part in parts:
+            counts = part.load('counts')
+            outputs['nodes'][node:node + part.pages] = part.load('nodes')
+            outputs['offsets'][node + 1:node + part.pages + 1] = edge + np.cumsum(counts)
+            for name in ('targets', 'valid_from', 'valid_to'):
+                values = part.load(name)
+                for start in range(0, part.edges, chunk_size):
+                    end = min(start + chunk_size, part.edges)
+                    outputs[name][edge + start:edge + end] = values[start:end]
+            node += part.pages
+            edge += part.edges
+
+    # The pages of the parts are sorted but overlap: they are merged with heapq.merge (pages with the same id in
+    # the order the files were added) and the edges are copied in runs of consecutive pages of the same part. At most
+    # page_chunk pages and chunk_size edges are held in memory.
+    @staticmethod
+    def merge(parts, outputs, chunk_size, page_chunk=1048576):
+        columns = [{name: part.load(name) for name in ('targets', 'valid_from', 'valid_to')} for part in parts]
+        positions = [0] * len(parts)
+        node = 0
+        edge = 0
+        outputs['offsets'][0] = 0
+        nodes = []
+        counts = []
+        runs = []
+        pages = heapq.merge(*[part.iter_pages(i) for i, part in enumerate(parts)])
+        for page_id, number, count in itertools.chain(pages, [(None, None, None)]):
+            if page_id is not None:
+                nodes.append(page_id)
+                counts.append(count)
+                if runs and runs[-1][0] == number:
+                    runs[-1][2] += count
+                else:
+                    runs.append([number, positions[number], count])
+                positions[number] += count
+                if len(nodes) < page_chunk:
+                    continue
+            outputs['nodes'][node:node + len(nodes)] = nodes
+            outputs['offsets'][node + 1:node + len(nodes) + 1] = edge + np.cumsum(counts)
+            node += len(nodes)
+            for number, start, size in runs:
+                for begin in range(0, size, chunk_size):
+                    end = min(begin + chunk_size, size)
+                    for name, values in columns[number].items():
+                        outputs[name][edge + begin:edge + end] = values[start + begin:start + end]
+                edge += size
+            nodes = []
+            counts = []
+            runs = []
+
+
+class LinkGraph(object):
+    """Adjacency of a graph at one point in time in CSR form: the targets of nodes[i] are
+    targets[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, nodes, offsets, targets):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.targets)
+
+    def neighbors(self, page_id):
+        i = np.searchsorted(self.nodes, page_id)
+        if i < len(self.nodes) and self.nodes[i] == page_id:
+            return self.targets[self.offsets[i]:self.offsets[i + 1]]
+        return self.targets[0:0]
+
+    # Yields (page_id, target_id) of every edge.
+    def edges(self):
+        for i, page_id in enumerate(self.nodes):
+            for target in self.targets[self.offsets[i]:self.offsets[i + 1]]:
+                yield int(page_id), int(target)
+
+
+class GraphStore(object):
+    """A graph written by GraphBuilder. The arrays are memory mapped, so at() only reads the validity
+    intervals (in chunks) and the targets of the edges valid at that time.
+    """
+    def __init__(self, path):
+        self.path = path
+        for name in ('nodes', 'offsets', 'targets', 'valid_from', 'valid_to'):
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+    def at(self, date, chunk_size=16777216):
+        t = to_epoch(date)
+        sources = []
+        targets = []
+        for start in range(0, len(self.targets), chunk_size):
+            end = min(start + chunk_size, len(self.targets))
+            valid = (self.valid_from[start:end] <= t) & (self.valid_to[start:end] > t)
+            positions = np.nonzero(valid)[0] + start
+            sources.append(np.searchsorted(self.offsets, positions, side='right') - 1)
+            targets.append(np.asarray(self.targets[positions]))
+        counts = np.bincount(np.concatenate(sources), minlength=len(self.nodes)) if sources else \
+            np.zeros(len(self.nodes), dtype=np.int64)
+        offsets = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.int64)
+        return LinkGraph(self.nodes, offsets, targets)
+
+
+# Builds the link and category graphs from the results of process_results() (the parsed_results folder).
+def build_graphs(path='parsed_results', title_ids=False, delta=False):
+    with open(os.path.join(path, '_project_files.json'), 'r') as infile:
+        parsed_files = json.load(infile)
+    times = RevisionTimes(os.path.join(path, parsed_files['revisions']))
+    revert_file = os.path.join(path, parsed_files['reverts']) if 'reverts' in parsed_files else None
+    inputs = {
+        'links': [os.path.join(path, 'links', f) for f in parsed_files.get('links', [])],
+        'cats': [os.path.join(path, parsed_files['cats'])] if 'cats' in parsed_files else []
+    }
+    for kind, files in inputs.items():
+        builder = GraphBuilder(os.path.join(path, 'graphs', kind), times, title_ids=title_ids, delta=delta,
+                               revert_file=revert_file)
+        for f in files:
+            if os.path.isfile(f):
+                builder.add_file(f)
+        builder.finish()
@@ -0,0 +1,107 @@
+import re
+from collections import OrderedDict
+
+# Every [[...]] in a wikitext. The target may not contain '[' or a line break, so for nested
+# markup like [[File:x.jpg|thumb|[[Foo]] bar]] only the inner link is matched, as before.
+WIKILINK = re.compile(r'\[\[([^\[\n]*?)\]\]')
+
+
+def normalize_title(title):
+    """Normalizes a title the way MediaWiki resolves it: underscores are spaces, runs of whitespace are
+    collapsed and the first letter is upper case. Equivalent targets therefore collapse into one.
+    """
+    title = ' '.join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+
+def classify(target):
+    """Returns 'category', 'link' or None (links into other namespaces and interwiki links).
+
+    A prefix of ASCII letters followed by a colon marks a namespace, like the lookahead of the regular
+    expression the parser used before. Titles such as 'Star Wars: Episode I' therefore remain links.
+    """
+    colon = target.find(':')
+    if colon > 0:
+        prefix = target[:colon]
+        if prefix.isascii() and prefix.isalpha():
+            if prefix == 'Category':
+                return 'category'
+            return None
+    return 'link'
+
+
+def scan_links(text):
+    """Walks a wikitext once and returns (target, kind) pairs in order of their first occurrence.
+
+    Anchors and piped labels are stripped from the targets and the titles are normalized (see normalize_title).
+    Categories keep their 'Category:' prefix and duplicates within the text are dropped.
+    """
+    pairs = []
+    seen = set()
+    for match in WIKILINK.finditer(text):
+        inner = match.group(1)
+        kind = classify(inner)
+        if kind is None:
+            continue
+        target = inner.split('|', 1)[0].split('#', 1)[0]
+        if kind == 'category':
+            title = normalize_title(target[9:])
+            target = 'Category:' + title
+        else:
+            title = target = normalize_title(target)
+        if not title or target in seen:
+            continue
+        seen.add(target)
+        pairs.append((target, kind))
+    return pairs
+
+
+def split_links(text):
+    """Same as scan_links, but returns two lists: categories and links."""
+    cats = []
+    links = []
+    for target, kind in scan_links(text):
+        if kind == 'category':
+            cats.append(target)
+        else:
+            links.append(target)
+    return cats, links
+
+
+class LinkCache(object):
+    """Links and categories extracted from revision texts, keyed by the sha1 of the text.
+
+    Reverts to an earlier text of the same page (and identical texts on other pages) reuse the extracted
+    lists instead of scanning the text again. Entries store the page and revision they were extracted from,
+    so a revision can be recorded as a copy of an earlier one. The least recently used entries are dropped
+    once more than size texts are cached.
+    """
+    def __init__(self, size=100000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha1):
+        if not sha1 or sha1 == 'NULL' or self.size <= 0:
+            return None
+        entry = self.entries.get(sha1)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(sha1)
+        self.hits += 1
+        return entry
+
+    def put(self, sha1, page_id, rev_id, cats, links):
+        if not sha1 or sha1 == 'NULL' or self.size <= 0:
+            return
+        self.entries[sha1] = (page_id, rev_id, cats, links)
+        self.entries.move_to_end(sha1)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def report(self):
+        lookups = max(self.hits + self.misses, 1)
+        return 'Link cache: %d hits, %d misses (%.1f%% of revision texts reused)' % (self.hits, self.misses,
+                                                                                   100.0 * self.hits / lookups)
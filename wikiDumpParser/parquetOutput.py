@@ -0,0 +1,226 @@
+import os
+import itertools
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+# Same as TIMESTAMP_FORMAT in processorData, the format of all timestamps in the dumps.
+DUMP_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Columns of every result in Parquet output: name, type and the position of the value in the rows written
+# by Processor.get_data (the revisions rows keep the ISO timestamp at 2 and the epoch at 4).
+COLUMNS = {
+    'page_info': [('page_id', 'int64', 0), ('title', 'string', 1), ('ns', 'int32', 2), ('created', 'timestamp', 3)],
+    'revisions': [('page_id', 'int64', 0), ('rev_id', 'int64', 1), ('timestamp', 'timestamp', 4),
+                  ('author_id', 'int64', 3)],
+    'author_info': [('author_id', 'int64', 0), ('name', 'string', 1)],
+    'no_text_error': [('page_id', 'int64', 0), ('rev_id', 'int64', 1)],
+    'cats': [('page_id', 'int64', 0), ('rev_id', 'int64', 1), ('target', 'dictionary', 2)],
+    'links': [('page_id', 'int64', 0), ('rev_id', 'int64', 1), ('target', 'dictionary', 2)],
+    'reverts': [('page_id', 'int64', 0), ('rev_id', 'int64', 1), ('reverted_to', 'int64', 2)],
+    # Links and categories with title ids (see titleDictionary) instead of the targets.
+    'cat_ids': [('page_id', 'int64', 0), ('rev_id', 'int64', 1), ('target_id', 'int64', 2)],
+    'link_ids': [('page_id', 'int64', 0), ('rev_id', 'int64', 1), ('target_id', 'int64', 2)],
+    'titles': [('target_id', 'int64', 0), ('title', 'string', 1)],
+    'title_pages': [('target_id', 'int64', 0), ('page_id', 'int64', 1)]
+}
+
+
+def available():
+    return pa is not None
+
+
+def require():
+    if pa is None:
+        raise ImportError('Parquet output needs pyarrow (pip install pyarrow).')
+
+
+def arrow_type(kind):
+    if kind == 'timestamp':
+        return pa.timestamp('s', tz='UTC')
+    if kind == 'dictionary':
+        return pa.dictionary(pa.int32(), pa.string())
+    return getattr(pa, kind)()
+
+
+def schema(name):
+    require()
+    return pa.schema([(column, arrow_type(kind)) for column, kind, position in COLUMNS[name]])
+
+
+def column(values, kind):
+    """Converts a list of values as written by the parser (strings, 'NULL' for missing ids) or a pandas
+    Series read back from Parquet to an Arrow array of the given kind.
+    """
+    if isinstance(values, list) and kind in ('int64', 'int32'):
+        values = [None if v is None or v == 'NULL' or v == '' else int(v) for v in values]
+    array = pa.array(values, from_pandas=True)
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    if kind == 'timestamp':
+        if pa.types.is_string(array.type):
+            array = pc.strptime(array, format=DUMP_TIMESTAMP_FORMAT, unit='s')
+        elif pa.types.is_integer(array.type):
+            array = array.cast(pa.int64()).cast(pa.timestamp('s'))
+        return array.cast(arrow_type(kind))
+    if kind == 'dictionary':
+        return array.cast(pa.string()).dictionary_encode()
+    return array.cast(arrow_type(kind))
+
+
+def rows_to_table(name, rows):
+    columns = COLUMNS[name]
+    return pa.Table.from_arrays([column([row[position] for row in rows], kind) for c, kind, position in columns],
+                                schema=schema(name))
+
+
+def frame_to_table(name, df):
+    return pa.Table.from_arrays([column(df[c], kind) for c, kind, position in COLUMNS[name]], schema=schema(name))
+
+
+class ParquetBuffer(object):
+    """Same interface as RowBuffer, but the rows of a result table are written to a Parquet file.
+
+    Every flush writes one row group with typed columns (int64 ids, UTC timestamps, dictionary encoded
+    targets), so the file grows while parsing proceeds and never has to be converted afterwards.
+    """
+    def __init__(self, path, name, max_rows=100000, compression='zstd'):
+        require()
+        self.path = path
+        self.name = name
+        self.max_rows = max_rows
+        self.compression = compression
+        self.buffer = []
+        self.writer = None
+        self.rows = 0
+        self.bytes = 0
+
+    def append(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.max_rows:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        table = rows_to_table(self.name, self.buffer)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, schema(self.name), compression=self.compression)
+        self.writer.write_table(table)
+        self.rows += len(self.buffer)
+        self.bytes += table.nbytes
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class ParquetTableWriter(object):
+    """Writes Arrow tables or pandas DataFrames of one result as row groups of a Parquet file."""
+    def __init__(self, path, name, compression='zstd'):
+        require()
+        self.name = name
+        self.schema = schema(name)
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def write_table(self, table):
+        if table.num_rows > 0:
+            self.writer.write_table(table.cast(self.schema))
+
+    def write_frame(self, df):
+        self.write_table(frame_to_table(self.name, df))
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Yields the row groups of a Parquet file as Arrow tables.
+def iter_tables(path, columns=None):
+    require()
+    parquet_file = pq.ParquetFile(path)
+    for i in range(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i, columns=columns)
+
+
+def iter_frames(path, columns=None):
+    for table in iter_tables(path, columns):
+        yield table.to_pandas()
+
+
+# Appends the row groups of all files to one new file, without converting them to pandas.
+def concat_files(files, path, name):
+    with ParquetTableWriter(path, name) as writer:
+        for f in files:
+            for table in iter_tables(f):
+                writer.write_table(table)
+
+
+# Converts a cats.csv, links.csv, reverts.csv or titles.csv of the parser into Parquet, chunk_rows rows
+# per row group.
+def convert_results(csv_file, parquet_file, name, chunk_rows=1000000):
+    fields = len(COLUMNS[name])
+    buffer = ParquetBuffer(parquet_file, name, max_rows=chunk_rows)
+    try:
+        if os.path.isfile(csv_file):
+            with open(csv_file, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    row = line.rstrip('\n').split('\t', fields - 1)
+                    if len(row) == fields:
+                        buffer.append(row)
+    finally:
+        buffer.close()
+    # A file without rows still gets its (empty) table, so every partition exists.
+    if buffer.rows == 0:
+        pq.write_table(schema(name).empty_table(), parquet_file)
+    return parquet_file
+
+
+# Yields the rows of a Parquet result as tab separated lines in the order of its columns, with timestamps in the
+# format of the dumps and NULL for missing values, so they sort and merge like the text results.
+def table_lines(path):
+    for table in iter_tables(path):
+        columns = []
+        for values in table.columns:
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(values.type.value_type)
+            elif pa.types.is_timestamp(values.type):
+                # Parquet stores seconds as milliseconds, which would add fractions to the seconds.
+                values = pc.strftime(values.cast(arrow_type('timestamp')), format=DUMP_TIMESTAMP_FORMAT)
+            columns.append(values.cast(pa.string()).fill_null('NULL').to_pylist())
+        for row in zip(*columns):
+            yield '\t'.join(row) + '\n'
+
+
+# Converts tab separated lines in the order of the columns of result name (see table_lines) into Parquet,
+# chunk_rows rows per row group. Fields after the last column are ignored.
+def convert_lines(lines_file, parquet_file, name, chunk_rows=1000000):
+    columns = COLUMNS[name]
+    with ParquetTableWriter(parquet_file, name) as writer:
+        with open(lines_file, 'r', encoding='utf-8') as infile:
+            while True:
+                rows = [line.rstrip('\n').split('\t') for line in itertools.islice(infile, chunk_rows)]
+                if not rows:
+                    break
+                writer.write_table(pa.Table.from_arrays([column([row[i] for row in rows], kind)
+                                                         for i, (c, kind, position) in enumerate(columns)],
+                                                        schema=writer.schema))
+    return parquet_file
@@ -1,105 +1,90 @@
 import os
+import bz2
 from pyunpack import Archive
-import requests
 from retrying import retry
 from xml.sax import parse
 from xml.sax.saxutils import XMLGenerator
 import numpy as np
 from lxml import etree
-import re
-import shutil
 import glob
 import subprocess
-from dateutil import parser
+import calendar
 import pandas as pd
 import hashlib
 import random
 import time
+import multiprocessing
+import itertools
+import resource
+from collections import deque
+from wikiDumpParser.resultWriter import *
+from wikiDumpParser.linkScanner import *
+from wikiDumpParser.downloader import *
+from wikiDumpParser.parquetOutput import convert_results, iter_tables
+from wikiDumpParser.titleDictionary import *
+from wikiDumpParser.resultCodec import *
+
+# Dumps always use this fixed UTC format, which sorts the same way as the points in time it represents.
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def iso_timestamp(epoch):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+
+def epoch_timestamp(timestamp):
+    # Fixed offsets are a lot faster than dateutil or strptime for the billions of revisions in a history dump.
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
 
 
 class Processor:
-    def __init__(self, file_name, data_path, base_url, status, start_date, md5):
+    def __init__(self, file_name, data_path, base_url, status, start_date, md5, streaming=False, parser_mode='tree',
+                 link_cache_size=100000, revert_markers=False, link_output='full',
+                 page_workers=1, download_segments=1, output_format='csv', title_ids=False,
+                 author_cache_size=100000, compression='xz'):
         self.file_name = file_name
         self.data_path_base = data_path
         self.data_path = os.path.join(self.data_path_base, os.path.splitext(self.file_name)[0])
         if not os.path.isdir(os.path.join(os.getcwd(), self.data_path)):
             os.makedirs(os.path.join(os.getcwd(), self.data_path))
         self.base_url = base_url
+        # Number of byte ranges of a large dump file that are downloaded in parallel.
+        self.download_segments = download_segments
         self.status = status
         self.start_date = start_date
+        # Revision timestamps are compared as strings against the start date in the dump's own format.
+        self.start_timestamp = iso_timestamp(start_date)
         self.md5 = md5
-
-        # List of files larger than 10GB.
-        # As of 1. March 2018 all of them are outside the scope of the parser and can be ignored.
-        # Automatic handling needs to be implemented.
-        self.ignore = [
-            # TITLE: Wikipedia:Village pump (policy), NS: 4
-            986140,
-            # TITLE: Wikipedia:Administrators' noticeboard/Incidents, NS: 4
-            5137507,
-            # TITLE: Wikipedia:Reference desk/Miscellaneous, NS: 4
-            40297,
-            # TITLE: Template talk:Did you know, NS: 11
-            972034,
-            # TITLE: Wikipedia:Reference desk/Humanities , NS: 4
-            2535875,
-            # TITLE: Wikipedia:Reference desk/Science , NS: 4
-            2535910,
-            # TITLE: Wikipedia talk:Manual of Style , NS: 5
-            75321,
-            # TITLE: Wikipedia:Help desk , NS: 4
-            564696,
-            # TITLE: Wikipedia:Reference desk/Language , NS: 4
-            2515121,
-            # TITLE: Wikipedia talk:Requests for adminship , NS: 5
-            2609426,
-            # TITLE: Wikipedia:Village pump (technical) , NS: 4
-            3252662,
-            # TITLE: Wikipedia:Administrators' noticeboard , NS: 4
-            5149102,
-            # TITLE: Wikipedia:In the news/Candidates , NS: 4
-            1470141,
-            # TITLE: Wikipedia:Administrators' noticeboard/Edit warring , NS: 4
-            3741656,
-            # TITLE: Wikipedia:Good article nominations , NS: 4
-            3514978,
-            # TITLE: Wikipedia:Village pump (proposals) , NS: 4
-            3706897,
-            # TITLE: Wikipedia:Reference desk/Computing , NS: 4
-            6041086,
-            # TITLE: User talk:DGG , NS: 3
-            6905700,
-            # TITLE: Wikipedia:Requested moves/Current discussions (alt) , NS: 4
-            23259666,
-            # TITLE: Wikipedia:Biographies of living persons/Noticeboard , NS: 4
-            6768170,
-            # TITLE: User:COIBot/LinkReports , NS: 2
-            10701605,
-            # TITLE: Wikipedia:Reliable sources/Noticeboard , NS: 4
-            11424955,
-            # TITLE: User talk:Jimbo Wales , NS: 3
-            9870625,
-            # TITLE: Wikipedia:Arbitration/Requests/Enforcement , NS: 4
-            12936136,
-            # TITLE: User talk:ImageTaggingBot/log , NS: 3
-            17820752,
-            # TITLE: Wikipedia:WikiProject Spam/LinkReports , NS: 4
-            16927404,
-            # TITLE: User:JamesR/AdminStats , NS: 2
-            18530389,
-            # TITLE: Template:AFC statistics , NS: 10
-            23309859,
-            # TITLE: Wikipedia:Requested moves/Current discussions , NS: 4
-            22998103,
-            # TITLE: User:West.andrew.g/Dead links , NS: 2
-            32101143,
-            # TITLE: User:B-bot/Event log , NS: 2
-            46505226,
-            # TITLE: User:Pentjuuu!.!/sandbox , NS: 2
-            42765277,
-            # TITLE: Wikipedia:Teahouse , NS: 4
-            34745517
-        ]
+        # If set, pages are parsed straight from the decompressor instead of unpacking and splitting on disk.
+        self.streaming = streaming
+        # 'tree' builds the full lxml element of every page, 'filter' drops unwanted pages and revisions while parsing.
+        self.parser_mode = parser_mode
+        # Reverts and other repeated texts reuse the links extracted before (see LinkCache).
+        self.link_cache = LinkCache(link_cache_size)
+        # If set, a revision with the same text as an earlier revision of the page is written to reverts.csv
+        # as (page_id, rev_id, rev_id of the earlier revision) instead of repeating its link and category rows.
+        self.revert_markers = revert_markers
+        # 'full' writes every link and category of every revision, 'delta' only (page_id, rev_id, target, +/-)
+        # events for targets added or removed since the previous revision of the page.
+        self.link_output = link_output
+        # Number of processes extracting the data of pages within this file, see parse_source_parallel.
+        self.page_workers = page_workers
+        # 'csv' writes tab separated results, 'parquet' typed Parquet files (see parquetOutput).
+        self.output_format = output_format
+        # If set, links and categories are written as title ids (see titleDictionary) instead of the targets
+        # and the titles of the ids to titles.csv.
+        self.title_ids = title_ids
+        self.titles = TitleDictionary()
+        # Codec cats.csv and links.csv are compressed with in postprocessing, 'xz' or 'zstd' (see resultCodec).
+        self.compression = compression
+        # Authors written recently are not written again for each of their revisions (see SeenSet).
+        self.authors = SeenSet(author_cache_size)
+        # Only articles and categories are parsed.
+        self.namespaces = ('0', '14')
+        # Split page files from this size on are parsed with the filter parser, which streams the revisions. The
+        # same size as the pages page workers get (see parse_source_parallel), a tree takes a multiple of it.
+        self.large_page_size = 67108864
 
     def process(self):
         if self.status == 'init':
@@ -134,32 +119,19 @@ class Processor:
                 new_status = 'post'
                 return new_status
 
+    # Failed attempts are retried and continue where the previous attempt stopped.
     @retry(wait_random_min=1000, wait_random_max=20000, stop_max_attempt_number=20)
     def download_dump_file(self):
-        x = random.randint(1, 120)
-        time.sleep(x)
-        response = requests.get(self.base_url + self.file_name, stream=True)
-        with open(os.path.join(self.data_path, self.file_name), "wb") as handle:
-            for data in response.iter_content(chunk_size=32768):
-                handle.write(data)
-        new_md5 = self.get_md5(os.path.join(self.data_path, self.file_name))
-        if new_md5 == self.md5:
-            return True
-        else:
-            os.remove(os.path.join(self.data_path, self.file_name))
-
-    @staticmethod
-    def get_md5(fname):
-        hash_md5 = hashlib.md5()
-        with open(fname, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        downloader = Downloader(source_for(self.base_url), segments=self.download_segments)
+        return downloader.download(self.file_name, os.path.join(self.data_path, self.file_name), self.md5)
 
     def unpack(self):
         Archive(os.path.join(self.data_path, self.file_name)).extractall(os.path.join(os.getcwd(), self.data_path))
 
     def split(self):
+        if self.streaming:
+            # Nothing to do on disk. parse() reads the pages directly from the archive.
+            return True
         self.unpack()
         file_to_split = os.path.join(self.data_path, os.path.splitext(self.file_name)[0])
         break_into = 'page'
@@ -174,252 +146,451 @@ class Processor:
         if not os.path.isdir(results_base):
             os.makedirs(results_base)
 
-        page_info_results_file = os.path.join(results_base, 'page_info.csv')
-        revision_info_results_file = os.path.join(results_base, 'revisions.csv')
-        no_text_error_results_file = os.path.join(results_base, 'no_text_error.csv')
-        author_info_results_file = os.path.join(results_base, 'author_info.csv')
-
         results_path = os.path.join(results_base, os.path.splitext(self.file_name)[0])
         if not os.path.isdir(results_path):
             os.makedirs(results_path)
-        cat_results_file = os.path.join(results_path, 'cats.csv')
-        link_results_file = os.path.join(results_path, 'links.csv')
 
-        for file in glob.glob(self.data_path+'/*'):
-            size = os.path.getsize(file)
-            if size < 10485760000:
-                for event, elem in etree.iterparse(file, tag='{http://www.mediawiki.org/xml/export-0.10/}page',
-                                                   huge_tree=True):
-                    for data in elem.iterchildren(reversed=False, tag='{http://www.mediawiki.org/xml/export-0.10/}ns'):
-                        ns = data.text
-                    if ns == '0' or ns == '14':
-                        page_info, revision_info, no_text_error, author_info = self.get_data(elem, cat_results_file, link_results_file)
-                        page_info.to_csv(page_info_results_file, sep='\t', mode='a', header=False, index=False)
-                        revision_info.to_csv(revision_info_results_file, sep='\t', mode='a', header=False, index=False)
-                        no_text_error.to_csv(no_text_error_results_file, sep='\t', mode='a', header=False, index=False)
-                        author_info.to_csv(author_info_results_file, sep='\t', mode='a', header=False, index=False)
-                    else:
-                        pass
-                    elem.clear()
-                    while elem.getprevious() is not None:
-                        del elem.getparent()[0]
+        if self.streaming:
+            archive = os.path.join(self.data_path, self.file_name)
+            # The whole dump is a single source, so pages are always streamed revision by revision: the tree
+            # parser would build any page in memory, however large.
+            with ResultWriter(results_path, output_format=self.output_format) as results:
+                with DumpStream(archive) as source:
+                    self.parse_source(source, results, parser_mode='filter')
+                # Only committed once DumpStream has checked that 7z decompressed the whole archive without error.
+                results.commit()
+            print(results.report())
+            print(self.link_cache.report())
+            print(self.memory_report())
+            os.remove(archive)
+            return True
+
+        with ResultWriter(results_path, output_format=self.output_format) as results:
+            # In the order of the pages in the dump, which RevertMarkers and GraphBuilder read fastest.
+            for file in CycleFile.files(os.path.join(self.data_path, os.path.splitext(self.file_name)[0])):
+                # The tree parser holds a whole page in memory, pages this large are streamed revision by revision.
+                if os.path.getsize(file) < self.large_page_size:
+                    self.parse_source(file, results)
+                else:
+                    self.parse_source(file, results, parser_mode='filter')
                 os.remove(file)
-            else:
-                too_large = os.path.join(self.data_path_base, 'too_large_to_parse')
-                if not os.path.isdir(too_large):
-                    os.makedirs(too_large)
-                try:
-                    subprocess.call(['7z', 'a', os.path.join(os.getcwd(), file + '.7z'),
-                                     os.path.join(os.getcwd(), file)])
-                    shutil.copy2(file+'.7z', too_large)
-                    os.remove(file)
-                    os.remove(file+'.7z')
-                except:
-                    pass
+            results.commit()
+        print(results.report())
+        print(self.link_cache.report())
+        print(self.memory_report())
         return True
 
-    def get_data(self, page, cat_results_file, link_results_file):
-        page_info = pd.DataFrame(columns=['page_id', 'page_title', 'page_ns', 'date_created'])
-        revision_info = pd.DataFrame(columns=['page_id', 'rev_id', 'rev_time', 'rev_author_id'])
-        author_info = pd.DataFrame(columns=['rev_author_id', 'rev_author_name'])
-        no_text_error = pd.DataFrame(columns=['page_id', 'rev_id'])
-        page_title = 'NULL'
-        page_id = 'NULL'
-        page_ns = 'NULL'
-        rev_id = 'NULL'
-        rev_time = 'NULL'
-        rev_author_name = 'NULL'
-        rev_author_id = 'NULL'
-        rev_parent = 'NULL'
-
-        # Get data for page_info
+    @staticmethod
+    def memory_report():
+        # ru_maxrss is in kilobytes on Linux. For the children it is the largest worker.
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        return 'Peak memory: %.0f MB parser, %.0f MB largest worker' % (own, workers)
+
+    # Source is either the path of a split page file or a file-like object with the decompressed dump.
+    def parse_source(self, source, results, parser_mode=None):
+        if self.page_workers > 1:
+            self.parse_source_parallel(source, results, parser_mode)
+            return
+        for page in self.iter_pages(source, parser_mode):
+            self.get_data(page, results)
+            results.end_page()
+
+    # This process only reads the pages. Batches of pages are handed to a pool of workers running get_data()
+    # and their rows are written in the order of the pages. At most queue_size batches are pending, so the
+    # reader never gets far ahead of the workers. Streamed pages with more than max_page_bytes of text are
+    # not sent to a worker but processed here revision by revision, once all pages before them are written.
+    def parse_source_parallel(self, source, results, parser_mode=None, batch_size=32, queue_size=None,
+                              max_page_bytes=67108864):
+        if queue_size is None:
+            queue_size = self.page_workers * 4
+        pending = deque()
+        batch = []
+        with multiprocessing.Pool(self.page_workers, initializer=init_page_worker, initargs=(self,)) as pool:
+            for page in self.iter_pages(source, parser_mode):
+                if not isinstance(page['revisions'], list):
+                    revisions, complete = self.take_revisions(page['revisions'], max_page_bytes)
+                    if not complete:
+                        if batch:
+                            pending.append(pool.apply_async(extract_pages, (batch,)))
+                            batch = []
+                        while pending:
+                            self.add_batch(results, pending.popleft().get())
+                        page['revisions'] = itertools.chain(revisions, page['revisions'])
+                        self.get_data(page, results)
+                        results.end_page()
+                        continue
+                    page['revisions'] = revisions
+                batch.append(page)
+                if len(batch) < batch_size:
+                    continue
+                pending.append(pool.apply_async(extract_pages, (batch,)))
+                batch = []
+                if len(pending) >= queue_size:
+                    self.add_batch(results, pending.popleft().get())
+                    results.end_page()
+            if batch:
+                pending.append(pool.apply_async(extract_pages, (batch,)))
+            while pending:
+                self.add_batch(results, pending.popleft().get())
+                results.end_page()
+
+    # Writes the rows of a batch of pages extracted by a worker and counts the link cache lookups of the worker,
+    # whose cache is its own copy.
+    def add_batch(self, results, rows):
+        results.add_rows(rows)
+        self.link_cache.hits += rows.link_cache_hits
+        self.link_cache.misses += rows.link_cache_misses
+
+    # Reads revisions until more than max_bytes of text are read. Returns the revisions read and whether
+    # that were all revisions of the page.
+    @staticmethod
+    def take_revisions(revisions, max_bytes):
+        taken = []
+        size = 0
+        for revision in revisions:
+            taken.append(revision)
+            size += len(revision['text'] or '')
+            if size > max_bytes:
+                return taken, False
+        return taken, True
+
+    # Yields page records (see PageTarget) of all pages in one of the parsed namespaces.
+    def iter_pages(self, source, parser_mode=None):
+        if (parser_mode or self.parser_mode) == 'filter':
+            for page in self.iter_filtered_pages(source):
+                yield page
+            return
+        for event, elem in etree.iterparse(source, tag='{http://www.mediawiki.org/xml/export-0.10/}page',
+                                           huge_tree=True):
+            for data in elem.iterchildren(reversed=False, tag='{http://www.mediawiki.org/xml/export-0.10/}ns'):
+                ns = data.text
+            if ns in self.namespaces:
+                yield self.page_record(elem)
+            else:
+                pass
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    # Pages of the filter parser are streamed revision by revision: 'revisions' is an iterator that is only
+    # valid until the next page is taken and each revision can be dropped once it is processed. Memory
+    # therefore does not depend on the size of a page.
+    def iter_filtered_pages(self, source, chunk_size=1048576):
+        events = self.filtered_events(source, chunk_size)
+        for kind, page in events:
+            if kind != 'page':
+                continue
+            page['revisions'] = self.stream_revisions(events)
+            yield page
+            # Skip what was not read of this page.
+            for revision in page['revisions']:
+                pass
+
+    @staticmethod
+    def stream_revisions(events):
+        for kind, revision in events:
+            if kind == 'end':
+                return
+            yield revision
+
+    def filtered_events(self, source, chunk_size):
+        target = PageTarget(self.namespaces, self.include_revision)
+        xml_parser = etree.XMLParser(target=target, huge_tree=True)
+        if isinstance(source, str):
+            source = open(source, 'rb')
+        try:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                xml_parser.feed(chunk)
+                for event in target.pop_events():
+                    yield event
+            xml_parser.close()
+            for event in target.pop_events():
+                yield event
+        finally:
+            source.close()
+
+    def include_revision(self, timestamp):
+        return timestamp >= self.start_timestamp
+
+    def page_record(self, page):
+        record = PageTarget.new_page()
         for elem in page.iterchildren(reversed=False, tag=None):
             if elem.tag == '{http://www.mediawiki.org/xml/export-0.10/}title':
-                page_title = elem.text
+                record['title'] = elem.text
             elif elem.tag == '{http://www.mediawiki.org/xml/export-0.10/}id':
-                page_id = elem.text
+                record['id'] = elem.text
             elif elem.tag == '{http://www.mediawiki.org/xml/export-0.10/}ns':
-                page_ns = elem.text
-
-        # Get data for revision_info
-        for revision in page.iterchildren(reversed=False, tag='{http://www.mediawiki.org/xml/export-0.10/}revision'):
-            include = False
-            for elem in revision.iterchildren(reversed=False, tag=None):
-                if elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}timestamp":
-                    if parser.parse(elem.text).timestamp() >= self.start_date:
-                        include = True
-                elif elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}parentid":
-                    rev_parent = elem.text
-                elif elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}timestamp":
-                    rev_time = elem.text
-                elif elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}contributor":
-                    for item in elem.iterchildren(reversed=False, tag=None):
-                        if item.tag == "{http://www.mediawiki.org/xml/export-0.10/}username":
-                            rev_author_name = item.text
-                        elif item.tag == "{http://www.mediawiki.org/xml/export-0.10/}id":
-                            rev_author_id = item.text
-                else:
-                    pass
-            if include:
-                for elem in revision.iterchildren(reversed=False, tag=None):
-                    if elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}id":
-                        rev_id = elem.text
-                    elif elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}parentid":
-                        rev_parent = elem.text
-                    elif elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}timestamp":
-                        rev_time = elem.text
-                    elif elem.tag == "{http://www.mediawiki.org/xml/export-0.10/}text":
-                        rev_cats, rev_links = self.links(elem.text)
-                        if not rev_links == 'ERROR':
-                            for link in rev_links:
-                                with open(link_results_file, 'a') as outfile:
-                                    outfile.write(page_id + '\t' + rev_id + '\t' + link + '\n')
-                        else:
-                            no_text_error = no_text_error.append(pd.DataFrame([[page_id, rev_id]],
-                                                                              columns=['page_id', 'rev_id']))
-                        if not rev_cats == 'ERROR':
-                            for cat in rev_cats:
-                                with open(cat_results_file, 'a') as outfile:
-                                    outfile.write(page_id + '\t' + rev_id + '\t' + cat + '\n')
-
-                # Write data for revision_info
-                revision_info = revision_info.append(pd.DataFrame([[page_id, rev_id, rev_time, rev_author_id]],
-                                                                  columns=['page_id', 'rev_id', 'rev_time', 'rev_author_id']))
-                # Write data for author_info
-                author_info = author_info.append(pd.DataFrame([[rev_author_id, rev_author_name]],
-                                                              columns=['rev_author_id', 'rev_author_name']))
-
+                record['ns'] = elem.text
+            elif elem.tag == '{http://www.mediawiki.org/xml/export-0.10/}revision':
+                revision = PageTarget.new_revision()
+                for item in elem.iterchildren(reversed=False, tag=None):
+                    name = etree.QName(item).localname
+                    if name == 'contributor':
+                        for author in item.iterchildren(reversed=False, tag=None):
+                            if author.tag == '{http://www.mediawiki.org/xml/export-0.10/}username':
+                                revision['author_name'] = author.text
+                            elif author.tag == '{http://www.mediawiki.org/xml/export-0.10/}id':
+                                revision['author_id'] = author.text
+                    elif name in revision:
+                        revision[name] = item.text
+                revision['include'] = self.include_revision(revision['timestamp'])
+                record['revisions'].append(revision)
+        return record
+
+    # Appends the rows for page_info, revisions, author_info and no_text_error to the buffers of results
+    # and writes categories and links to its sinks.
+    def get_data(self, page, results):
+        page_id = page['id']
+        # Targets of the previous revision, only needed for link_output 'delta'
+        current_links = set()
+        current_cats = set()
+
+        for revision in page['revisions']:
+            rev_id = revision['id']
             # Write data for page_info, include time of the first revision for the creation time of the page
-            if rev_parent == 'NULL':
-                page_info = page_info.append(pd.DataFrame([[page_id, page_title, page_ns, rev_time]],
-                                                          columns=['page_id', 'page_title', 'page_ns', 'date_created']))
-        return page_info, revision_info, no_text_error, author_info
+            if revision['parentid'] == 'NULL':
+                results.page_info.append((page_id, page['title'], page['ns'], revision['timestamp']))
+            if not revision['include']:
+                continue
+
+            cached = self.link_cache.get(revision['sha1'])
+            if cached is not None and self.revert_markers and self.link_output == 'full' and cached[0] == page_id:
+                results.reverts.write(page_id, rev_id, cached[1])
+                rev_cats, rev_links = [], []
+            elif cached is not None:
+                rev_cats, rev_links = cached[2], cached[3]
+            else:
+                rev_cats, rev_links = self.links(revision['text'])
+                if not rev_links == 'ERROR':
+                    if self.title_ids:
+                        rev_cats = self.titles.intern(rev_cats, results.titles)
+                        rev_links = self.titles.intern(rev_links, results.titles)
+                    self.link_cache.put(revision['sha1'], page_id, rev_id, rev_cats, rev_links)
+            if rev_links == 'ERROR':
+                results.no_text_error.append((page_id, rev_id))
+            elif self.link_output == 'delta':
+                current_links = self.write_events(results.links, page_id, rev_id, current_links, rev_links)
+                current_cats = self.write_events(results.cats, page_id, rev_id, current_cats, rev_cats)
+            else:
+                for link in rev_links:
+                    results.links.write(page_id, rev_id, link)
+                for cat in rev_cats:
+                    results.cats.write(page_id, rev_id, cat)
+
+            # Write data for revision_info
+            results.revisions.append((page_id, rev_id, revision['timestamp'], revision['author_id'],
+                                      epoch_timestamp(revision['timestamp'])))
+            # Write data for author_info
+            if self.authors.add((revision['author_id'], revision['author_name'])):
+                results.author_info.append((revision['author_id'], revision['author_name']))
+
+    # Writes the targets added (+) and removed (-) since the previous revision of the page and returns the new set.
+    @staticmethod
+    def write_events(sink, page_id, rev_id, previous, targets):
+        current = set(targets)
+        for target in targets:
+            if target not in previous:
+                sink.write(page_id, rev_id, target, '+')
+        for target in sorted(previous - current):
+            sink.write(page_id, rev_id, target, '-')
+        return current
+
+    # Rebuilds the targets of every revision with events from a links.csv or cats.csv written with
+    # link_output 'delta'. Yields page_id, rev_id and the set of targets after that revision.
+    @staticmethod
+    def replay_events(event_file):
+        page_id = None
+        rev_id = None
+        targets = set()
+        with open_results(event_file, 'rt') as infile:
+            for line in infile:
+                fields = line.rstrip('\n').split('\t')
+                event_page, event_rev, target, op = fields[0], fields[1], '\t'.join(fields[2:-1]), fields[-1]
+                if event_page != page_id or event_rev != rev_id:
+                    if rev_id is not None:
+                        yield page_id, rev_id, frozenset(targets)
+                    if event_page != page_id:
+                        targets = set()
+                    page_id, rev_id = event_page, event_rev
+                if op == '+':
+                    targets.add(target)
+                else:
+                    targets.discard(target)
+        if rev_id is not None:
+            yield page_id, rev_id, frozenset(targets)
+
+    # Inserts the revisions recorded as revert markers (see RevertMarkers) into the revisions (page_id, rev_id,
+    # targets) of a results file, in file order. Yields page_id, rev_id, targets and whether the revision is a
+    # marker. A marker has the targets the page had at the revision it reverted to: those of that revision, or
+    # of the revision before it if it has no rows (unchanged revisions are removed from the results).
+    @staticmethod
+    def replay_reverts(revisions, reverts):
+        page_id = None
+        events = deque()
+        saved = {}
+        current = []
+        for page, rev_id, targets in itertools.chain(revisions, [(None, None, None)]):
+            if page != page_id:
+                # Markers after the last revision with rows of the page.
+                for event_rev, reverted_to in events:
+                    if reverted_to is not None:
+                        current = saved.get(reverted_to, current)
+                        yield page_id, event_rev, current, True
+                if page is None:
+                    return
+                page_id = page
+                markers = reverts.page(int(page))
+                # Points to save the targets at (the revisions reverted to) and the markers, in revision order.
+                events = deque(sorted([(reverted_to, None) for reverted_to in set(to for _, to in markers)] + markers,
+                                      key=lambda event: (event[0], event[1] is not None)))
+                saved = {}
+                current = []
+            while events and events[0][0] < int(rev_id):
+                event_rev, reverted_to = events.popleft()
+                if reverted_to is None:
+                    saved.setdefault(event_rev, current)
+                else:
+                    current = saved.get(reverted_to, current)
+                    yield page_id, event_rev, current, True
+            current = targets
+            if events and events[0] == (int(rev_id), None):
+                saved[int(rev_id)] = targets
+            yield page_id, rev_id, targets, False
 
     # Returns two lists (cats and links) containing each only links to articles and links to categories
+    # with anchors and labels already removed. Revisions without text return 'ERROR' for both.
     @staticmethod
     def links(text):
-        # Extract links from revision text.
-        # Returns: links
-        try:
-            if re.search(r"\[\[Category\:(.*?)\]\]", text):
-                cats = re.findall(r"\[\[Category\:(.*?)\]\]", text)
-                cats = ['Category:'+x for x in cats]
-            else:
-                cats = []
-        except:
-            cats = 'ERROR'
-
-        try:
-            if re.search(r"(?!\[\[(?:[A-Za-z]+\:))\[\[(.*?)\]\]", text):
-                links = re.findall(r"(?!\[\[(?:[A-Za-z]+\:))\[\[(.*?)\]\]", text)
-            else:
-                links = []
-        except:
-            links = 'ERROR'
-        return cats, links
+        if text is None:
+            return 'ERROR', 'ERROR'
+        return split_links(text)
 
     def postprocessing_cat_link(self):
         results_base = os.path.join(self.data_path_base, 'results')
-        relevant_revisions_file = os.path.join(results_base, 'relevant_revisions.csv')
         results_path = os.path.join(results_base, os.path.splitext(self.file_name)[0])
+        relevant_revisions_file = os.path.join(results_path, 'relevant_revisions.csv')
         cat_results_file = os.path.join(results_path, 'cats.csv')
         link_results_file = os.path.join(results_path, 'links.csv')
+        revert_results_file = os.path.join(results_path, 'reverts.csv')
+        # Parquet output is converted from the text files below, other results are compressed in the same pass
+        # that removes unchanged revisions.
+        suffix = '' if self.output_format == 'parquet' else EXTENSIONS[self.compression]
+        # Events only contain revisions that changed the links or categories, nothing to remove.
+        if self.link_output == 'full':
+            try:
+                cat_results_file = self.process_categories(cat_results_file, suffix, revert_results_file)
+            except:
+                pass
+            try:
+                link_results_file = self.process_links(link_results_file, suffix, revert_results_file)
+            except:
+                pass
+        elif suffix:
+            cat_results_file = compress_file(cat_results_file, cat_results_file + suffix)
+            link_results_file = compress_file(link_results_file, link_results_file + suffix)
         try:
-            cat_results_file = self.process_categories(cat_results_file)
-        except:
-            pass
-        try:
-            link_results_file = self.process_links(link_results_file)
-        except:
-            pass
-        try:
-            relevant_revisions = self.assemble_list_of_relevant_revisions(cat_results_file, link_results_file)
-            relevant_revisions.to_csv(relevant_revisions_file, sep='\t', index=False, header=False, mode='a')
-        except:
-            pass
-        try:
-            subprocess.call(['7z', 'a', os.path.join(os.getcwd(), cat_results_file + '.7z'),
-                             os.path.join(os.getcwd(), cat_results_file)])
-            os.remove(cat_results_file)
-        except:
-            pass
-        try:
-            subprocess.call(['7z', 'a', os.path.join(os.getcwd(), link_results_file + '.7z'),
-                             os.path.join(os.getcwd(), link_results_file)])
-            os.remove(link_results_file)
+            relevant_revisions = self.assemble_list_of_relevant_revisions(cat_results_file, link_results_file,
+                                                                          revert_results_file)
+            relevant_revisions.to_csv(relevant_revisions_file + '.tmp', sep='\t', index=False, header=False, mode='w')
+            os.rename(relevant_revisions_file + '.tmp', relevant_revisions_file)
         except:
             pass
+        # Link and category events are replayed from their text files, so only full results are converted.
+        if self.output_format == 'parquet' and self.link_output == 'full':
+            cats, links = ('cat_ids', 'link_ids') if self.title_ids else ('cats', 'links')
+            for name, results_file in ((cats, cat_results_file), (links, link_results_file),
+                                       ('reverts', revert_results_file)):
+                convert_results(results_file, os.path.splitext(results_file)[0] + '.parquet', name)
+                if os.path.isfile(results_file):
+                    os.remove(results_file)
         return True
 
-    def process_categories(self, cat_file):
-        tmp_results_file = cat_file + 'tmp_results.csv'
-        chunksize = 10 ** 6
-        for chunk in pd.read_csv(cat_file, header=None, delimiter='\t', names=['page_id', 'rev_id', 'target'],
-                                 chunksize=chunksize):
-            chunk['target'] = chunk['target'].astype(str)
-            chunk = chunk.dropna().reset_index().drop('index', 1)
-            chunk = self.clean_labels(chunk, 'target')
-            chunk = chunk.dropna().reset_index().drop('index', 1)
-            chunk = self.unique_revisions(chunk)
-            chunk.to_csv(tmp_results_file, sep='\t', index=False, header=False, mode='a')
-        os.remove(cat_file)
-        os.rename(tmp_results_file, cat_file)
-        return cat_file
-
-    def process_links(self, link_file):
-        tmp_results_file = link_file+'tmp_results.csv'
-        chunksize = 10 ** 6
-        for chunk in pd.read_csv(link_file, header=None, delimiter='\t', names=['page_id', 'rev_id', 'target'],
-                                 chunksize=chunksize):
-            chunk['target'] = chunk['target'].astype(str)
-            chunk = chunk.dropna().reset_index().drop('index', 1)
-            chunk = self.clean_labels(chunk, 'target')
-            chunk = chunk.dropna().reset_index().drop('index', 1)
-            chunk = self.unique_revisions(chunk)
-            chunk.to_csv(tmp_results_file, sep='\t', index=False, header=False, mode='a')
-
-        os.remove(link_file)
-        os.rename(tmp_results_file, link_file)
-        return link_file
+    def process_categories(self, cat_file, suffix='', revert_file=None):
+        return self.remove_unchanged_revisions(cat_file, cat_file + suffix, revert_file)
 
+    def process_links(self, link_file, suffix='', revert_file=None):
+        return self.remove_unchanged_revisions(link_file, link_file + suffix, revert_file)
+
+    # Single pass over a cats.csv or links.csv: drops empty targets and every revision with the same
+    # targets as the previous revision of the page. The rows are written to output_file (compressed if
+    # its extension is one of resultCodec) and the results file is removed. Revert markers of revert_file
+    # have no rows, the revision after a marker is compared with the targets of the revision reverted to.
     @staticmethod
-    def clean_labels(df, dimension):
-        for row in df.itertuples():
-            if bool(re.search(r"(.*?)[\#\|]", getattr(row, dimension))):
-                clean_title = re.search(r"(.*?)[\#\|]", getattr(row, dimension)).group(1)
-                df.set_value(row.Index, dimension, clean_title)
+    def remove_unchanged_revisions(results_file, output_file=None, revert_file=None):
+        if output_file is None:
+            output_file = results_file
+        tmp_results_file = os.path.join(os.path.dirname(output_file), 'tmp_' + os.path.basename(output_file))
+        unique = UniqueRevisions()
+        with open(results_file, 'r', encoding='utf-8') as infile, open_results(tmp_results_file, 'wt') as outfile:
+            rows = (line.rstrip('\n').split('\t', 2) for line in infile)
+            rows = (fields for fields in rows if len(fields) == 3 and fields[2])
+            if revert_file is not None and os.path.isfile(revert_file) and os.path.getsize(revert_file) > 0:
+                revisions = ((key[0], key[1], [fields[2] for fields in group])
+                             for key, group in itertools.groupby(rows, key=lambda fields: (fields[0], fields[1])))
+                for page_id, rev_id, targets, marker in Processor.replay_reverts(revisions,
+                                                                                 RevertMarkers(revert_file)):
+                    if marker:
+                        changed = unique.revert(targets)
+                    else:
+                        changed = [row for target in targets for row in unique.add(page_id, rev_id, target)]
+                    for row in changed:
+                        outfile.write('\t'.join(row) + '\n')
             else:
-                pass
+                for fields in rows:
+                    for row in unique.add(fields[0], fields[1], fields[2]):
+                        outfile.write('\t'.join(row) + '\n')
+            for row in unique.finish():
+                outfile.write('\t'.join(row) + '\n')
+        os.remove(results_file)
+        os.rename(tmp_results_file, output_file)
+        return output_file
+
+    # Labels are already removed and titles normalized by the link scanner while parsing. This is the
+    # vectorized equivalent for results of older runs: removes anchors and labels, normalizes the titles
+    # like normalize_title(), drops empty targets and duplicate rows.
+    @staticmethod
+    def clean_labels(df, dimension):
+        labels = df[dimension].astype(str).str.extract(r'^([^#|]*)', expand=False)
+        labels = labels.str.replace('_', ' ').str.replace(r'\s+', ' ', regex=True).str.strip()
+        is_cat = labels.str.startswith('Category:')
+        titles = labels.where(~is_cat, labels.str[9:].str.strip())
+        titles = titles.str[:1].str.upper() + titles.str[1:]
+        df = df.copy()
+        df[dimension] = titles.where(~is_cat, 'Category:' + titles)
+        df = df[titles != '']
         df = df.drop_duplicates()
         return df
 
     @staticmethod
     def unique_revisions(df):
-        curr_page = 0
-        unique = pd.DataFrame()
-        for name, group in df.groupby(['page_id', 'rev_id']):
-            group_sorted = group.sort_values(['target'])
-            if not name[0] == curr_page:
-                curr_page = name[0]
-                curr_labels = group_sorted.values
-                unique = unique.append(group, ignore_index=True)
-            elif not np.array_equiv(curr_labels.transpose()[2], group_sorted.values.transpose()[2]):
-                unique = unique.append(group, ignore_index=True)
-                curr_labels = group_sorted.values
-            else:
-                pass
-        return unique
-
-    def assemble_list_of_relevant_revisions(self, cat_file, link_file):
+        unique = UniqueRevisions()
+        rows = []
+        for row in df[['page_id', 'rev_id', 'target']].itertuples(index=False):
+            rows.extend(unique.add(*row))
+        rows.extend(unique.finish())
+        return pd.DataFrame(rows, columns=['page_id', 'rev_id', 'target'])
+
+    def assemble_list_of_relevant_revisions(self, cat_file, link_file, revert_file=None):
         results = pd.DataFrame()
         results = self.read_revisions(cat_file, results)
         results = self.read_revisions(link_file, results)
+        if revert_file is not None:
+            results = self.read_revisions(revert_file, results)
         results = results.drop_duplicates().reset_index().drop('index', 1)
         return results
 
     def read_revisions(self, file, results):
+        # Files of pages without any categories, links or reverts are empty.
+        if not os.path.isfile(file) or os.path.getsize(file) == 0:
+            return results
         chunksize = 10 ** 6
-        for chunk in pd.read_csv(file, delimiter='\t', names=['page_id', 'rev_id', 'target'], chunksize=chunksize):
+        # Only the revision column, event files have a fourth column. Compressed files are read as a stream.
+        try:
+            chunks = pd.read_csv(file, delimiter='\t', header=None, usecols=[1], names=['rev_id'], chunksize=chunksize)
+        except pd.errors.EmptyDataError:
+            return results
+        for chunk in chunks:
             tmp_data = pd.DataFrame()
             tmp_data = chunk['rev_id']
             tmp_data = tmp_data.to_frame()
@@ -428,6 +599,245 @@ class Processor:
         return results
 
 
+# Processor of a page worker, set by init_page_worker.
+page_processor = None
+
+
+def init_page_worker(processor):
+    global page_processor
+    page_processor = processor
+
+
+def extract_pages(pages):
+    rows = RowCollector()
+    hits, misses = page_processor.link_cache.hits, page_processor.link_cache.misses
+    for page in pages:
+        page_processor.get_data(page, rows)
+    rows.link_cache_hits = page_processor.link_cache.hits - hits
+    rows.link_cache_misses = page_processor.link_cache.misses - misses
+    return rows
+
+
+class UniqueRevisions(object):
+    """Streaming removal of revisions whose targets are the same as those of the previous revision of the page.
+
+    Rows are added in file order, where the rows of a revision follow each other. Only a hash of the sorted
+    targets of the previous revision is kept per page, so one O(n) pass with constant memory handles files of
+    any size, and chunk boundaries make no difference as long as the same instance is used.
+    """
+    def __init__(self):
+        self.page_id = None
+        self.rev_id = None
+        self.targets = []
+        self.previous = None
+
+    # Returns the rows of the previous revision if the revision is complete and has changed, else nothing.
+    def add(self, page_id, rev_id, target):
+        if rev_id == self.rev_id and page_id == self.page_id:
+            self.targets.append(target)
+            return []
+        rows = self.finish()
+        if page_id != self.page_id:
+            self.previous = None
+        self.page_id = page_id
+        self.rev_id = rev_id
+        self.targets = [target]
+        return rows
+
+    # Returns the rows of the last revision if it has changed.
+    def finish(self):
+        if self.rev_id is None:
+            return []
+        rev_id = self.rev_id
+        targets = list(dict.fromkeys(self.targets))
+        digest = self.digest(targets)
+        changed = digest != self.previous
+        self.previous = digest
+        self.rev_id = None
+        self.targets = []
+        if not changed:
+            return []
+        return [(self.page_id, rev_id, target) for target in targets]
+
+    # A revert marker of the page: the next revision is compared with the targets of the marker.
+    def revert(self, targets):
+        rows = self.finish()
+        self.previous = self.digest(list(dict.fromkeys(targets)))
+        return rows
+
+    @staticmethod
+    def digest(targets):
+        return hashlib.md5('\n'.join(sorted(targets)).encode('utf-8')).digest()
+
+
+class RevertMarkers(object):
+    """The revert markers (page_id, rev_id, rev_id reverted to) of a reverts.csv or reverts.parquet by page.
+
+    Like RevisionTimes, the markers are kept as int64 arrays sorted by page and revision, so the pages can be
+    looked up in any order with a binary search and the file is read only once.
+    """
+    def __init__(self, revert_file, chunksize=10000000):
+        columns = {'page_id': [], 'rev_id': [], 'reverted_to': []}
+        if revert_file.endswith('.parquet'):
+            for table in iter_tables(revert_file):
+                for name, values in columns.items():
+                    values.append(table[name].to_numpy())
+        elif os.path.isfile(revert_file) and os.path.getsize(revert_file) > 0:
+            for chunk in pd.read_csv(revert_file, delimiter='\t', header=None, names=list(columns), dtype=np.int64,
+                                     chunksize=chunksize):
+                for name, values in columns.items():
+                    values.append(chunk[name].to_numpy())
+        for name, values in columns.items():
+            columns[name] = np.concatenate(values) if values else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((columns['rev_id'], columns['page_id']))
+        self.page_ids = columns['page_id'][order]
+        self.rev_ids = columns['rev_id'][order]
+        self.reverted_to = columns['reverted_to'][order]
+
+    # Returns (rev_id, rev_id reverted to) of every marker of the page, sorted by revision.
+    def page(self, page_id):
+        start = np.searchsorted(self.page_ids, page_id, side='left')
+        end = np.searchsorted(self.page_ids, page_id, side='right')
+        return list(zip(self.rev_ids[start:end].tolist(), self.reverted_to[start:end].tolist()))
+
+
+class DumpStream(object):
+    """Read-only stream of the decompressed XML inside a dump archive.
+
+    bz2 dumps are decompressed in-process, everything else is piped through ``7z e -so``,
+    so the uncompressed XML never touches the disk.
+    """
+    def __init__(self, archive, buffer_size=1048576):
+        self.archive = archive
+        self.buffer_size = buffer_size
+        self.process = None
+        self.stream = None
+
+    def __enter__(self):
+        if self.archive.endswith('.bz2'):
+            self.stream = bz2.open(self.archive, 'rb')
+        else:
+            self.process = subprocess.Popen(['7z', 'e', '-so', self.archive], stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, bufsize=self.buffer_size)
+            self.stream = self.process.stdout
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if exc_type is None and self.process is not None and self.process.returncode != 0:
+            raise IOError('7z failed to decompress ' + self.archive + ' (exit code ' +
+                          str(self.process.returncode) + ')')
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+        if self.process is not None:
+            self.process.wait()
+
+
+class PageTarget(object):
+    """lxml parser target that turns <page> elements into plain page records.
+
+    <ns> precedes the revisions and <timestamp> precedes the text of a revision, so pages outside
+    the parsed namespaces and revisions before the start date are dropped before their text is
+    buffered. Kept pages are reported as events, which are collected until they are taken with
+    pop_events(): ('page', page record) before the first revision, ('revision', revision record)
+    for every revision and ('end', None) at the end of the page. No page holds more than one
+    revision, however large it is.
+    """
+    page_fields = ('title', 'id', 'ns')
+    revision_fields = ('id', 'parentid', 'timestamp', 'text', 'sha1')
+    contributor_fields = {'username': 'author_name', 'id': 'author_id'}
+
+    def __init__(self, namespaces, include_revision):
+        self.namespaces = namespaces
+        self.include_revision = include_revision
+        self.events = []
+        self.path = []
+        self.page = None
+        self.page_started = False
+        self.revision = None
+        self.buffer = None
+
+    @staticmethod
+    def new_page():
+        return {'id': 'NULL', 'title': 'NULL', 'ns': 'NULL', 'revisions': []}
+
+    @staticmethod
+    def new_revision():
+        return {'id': 'NULL', 'parentid': 'NULL', 'timestamp': 'NULL', 'author_id': 'NULL',
+                'author_name': 'NULL', 'text': None, 'sha1': 'NULL', 'include': True}
+
+    def pop_events(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def start_page(self):
+        if not self.page_started:
+            self.events.append(('page', self.page))
+            self.page_started = True
+
+    def start(self, tag, attrib):
+        name = tag.rpartition('}')[2]
+        parent = self.path[-1] if self.path else None
+        self.path.append(name)
+        if name == 'page':
+            self.page = self.new_page()
+            self.page_started = False
+        elif self.page is None:
+            pass
+        elif parent == 'page':
+            if name == 'revision':
+                self.revision = self.new_revision()
+            elif name in self.page_fields:
+                self.buffer = []
+        elif self.revision is None:
+            pass
+        elif parent == 'revision':
+            # Only the timestamp of revisions before the start date and the parent id needed for page_info are kept.
+            if name in self.revision_fields and (self.revision['include'] or name in ('parentid', 'timestamp')):
+                self.buffer = []
+        elif parent == 'contributor' and self.revision['include'] and name in self.contributor_fields:
+            self.buffer = []
+
+    def data(self, data):
+        if self.buffer is not None:
+            self.buffer.append(data)
+
+    def end(self, tag):
+        name = self.path.pop()
+        parent = self.path[-1] if self.path else None
+        if self.buffer is not None:
+            value = ''.join(self.buffer) or None
+            self.buffer = None
+            if parent == 'page':
+                self.page[name] = value
+                if name == 'ns' and value not in self.namespaces:
+                    self.page = None
+            elif parent == 'revision':
+                self.revision[name] = value
+                if name == 'timestamp':
+                    self.revision['include'] = self.include_revision(value)
+            else:
+                self.revision[self.contributor_fields[name]] = value
+        elif name == 'revision' and self.page is not None:
+            self.start_page()
+            self.events.append(('revision', self.revision))
+            self.revision = None
+        elif name == 'page':
+            if self.page is not None:
+                self.start_page()
+                self.events.append(('end', None))
+            self.page = None
+
+    def close(self):
+        return None
+
+
 class CycleFile(object):
     def __init__(self, filename):
         self.basename, self.ext = os.path.splitext(filename)
@@ -455,6 +865,17 @@ class CycleFile(object):
     def close(self):
         self.file.close()
 
+    # The files written for filename, in the order they were written.
+    @staticmethod
+    def files(filename):
+        basename, ext = os.path.splitext(filename)
+        files = []
+        for file in glob.glob(glob.escape(basename) + '*' + glob.escape(ext)):
+            index = file[len(basename):len(file) - len(ext)]
+            if index.isdigit():
+                files.append((int(index), file))
+        return [file for index, file in sorted(files)]
+
 
 # Splitting large XML files into smaller files, based on element is based on
 # https://gist.github.com/nicwolff/b4da6ec84ba9c23c8e59
@@ -1,137 +1,329 @@
 import os
-from pyunpack import Archive
 import shutil
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 import glob
 import json
+import io
+import itertools
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from wikiDumpParser.processorData import Processor, epoch_timestamp
+from wikiDumpParser.resultWriter import ResultWriter
+from wikiDumpParser.parquetOutput import *
+from wikiDumpParser.titleDictionary import *
+from wikiDumpParser.externalDedup import dedup_lines, dedup_parquet
+from wikiDumpParser.externalMerge import *
+from wikiDumpParser.resultCodec import find_results, read_lines, decompress_blocks, link_or_copy
 
 class ProcessorResults:
     def __init__(self, project):
         self.project = project
-
-    @staticmethod
-    def unpack(path, f):
-        Archive(os.path.join(path, f)).extractall(os.path.join(os.getcwd(), path))
-        return f[:-3]
+        # Results of projects with output_format 'parquet' are read and written as Parquet files.
+        self.ext = '.parquet' if project.get_output_format() == 'parquet' else '.csv'
+        self.title_ids = project.get_title_ids()
 
     def process(self):
         self.assemble_cat_results()
         self.update_revisions_file()
         self.group_links_files()
         self.group_page_info()
+        if self.project.get_revert_markers():
+            self.group_revert_markers()
+        if self.title_ids:
+            self.build_title_index()
         self.remove_duplicate_authors()
         self.combine_parsed_results()
 
+    # Files of a result table: the shared file written by older versions and the partition of every dump file.
+    def partitions(self, f):
+        files = []
+        shared = os.path.join(self.project.results_path, f)
+        if os.path.isfile(shared):
+            files.append(shared)
+        for key in self.project.pinfo['dump']:
+            partition = os.path.join(self.project.results_path, os.path.splitext(key)[0], ResultWriter.partition, f)
+            if os.path.isfile(partition):
+                files.append(partition)
+        return files
+
+    # Pairs of the relevant revisions and the revisions table that belong together.
+    def revision_partitions(self, f='revisions.csv'):
+        pairs = [(os.path.join(self.project.results_path, 'relevant_revisions.csv'),
+                  os.path.join(self.project.results_path, f))]
+        for key in self.project.pinfo['dump']:
+            path = os.path.join(self.project.results_path, os.path.splitext(key)[0])
+            pairs.append((os.path.join(path, 'relevant_revisions.csv'),
+                          os.path.join(path, ResultWriter.partition, f)))
+        return [(relevant, revisions) for relevant, revisions in pairs
+                if os.path.isfile(relevant) and os.path.isfile(revisions) and os.path.getsize(relevant) > 0]
+
     def assemble_cat_results(self):
-        for key, value in tqdm(self.project.pinfo['dump'].items(), desc='Assemble category results in one file:'):
-            path = os.path.join(self.project.results_path, key[:-3])
-            f = 'cats.csv.7z'
-            f = self.unpack(path, f)
-            if os.path.isfile(os.path.join(path, f)):
-                data = pd.read_csv(os.path.join(path, f), header=None, delimiter='\t', na_filter=False)
-                # self.cats = self.cats.append(data)
-                results = os.path.join(self.project.data_path, 'cats_all.csv')
-                data.to_csv(results, sep='\t', index=False, header=False, mode='a')
-                os.remove(os.path.join(path, f))
-
-    def remove_duplicate_authors(self):
-        authors_file = os.path.join(self.project.results_path, 'author_info.csv')
-        authors = pd.read_csv(authors_file, delimiter='\t', names=['id', 'name'])
-        relevant_authors = authors.drop_duplicates()
-        results = os.path.join(self.project.data_path, 'author_info_processed.csv')
-        relevant_authors.to_csv(results, sep='\t', index=False, header=False, mode='w')
-
-    def update_revisions_file(self):
-        relevant_revs_file = os.path.join(self.project.results_path, 'relevant_revisions.csv')
-        rev_data_file = os.path.join(self.project.results_path, 'revisions.csv')
-        relevant_revs = pd.read_csv(relevant_revs_file, delimiter='\t', names=['rev_id'])
-        rev_data = pd.read_csv(rev_data_file, delimiter='\t', names=['page_id', 'rev_id', 'ts', 'author_id'])
-        rev_data = rev_data[rev_data['rev_id'].isin(relevant_revs['rev_id'])].reset_index().drop('index', 1)
+        if self.ext == '.parquet':
+            files = [os.path.join(self.project.results_path, os.path.splitext(key)[0], 'cats.parquet')
+                     for key in self.project.pinfo['dump']]
+            name = 'cat_ids' if self.title_ids else 'cats'
+            concat_files([f for f in files if os.path.isfile(f)],
+                         os.path.join(self.project.data_path, 'cats_all.parquet'), name)
+            return
+        files = []
+        for key in self.project.pinfo['dump']:
+            path = os.path.join(self.project.results_path, os.path.splitext(key)[0])
+            f = find_results(path, 'cats.csv')
+            if f is not None:
+                files.append(f)
+        self.assemble_files(files, os.path.join(self.project.data_path, 'cats_all.csv'),
+                            self.project.get_parallel_processes() or 1)
+
+    # Up to processes partitions are decompressed at the same time, each by its own process. A compressed
+    # stream can only be decompressed from its start, so every process streams one whole partition in blocks
+    # through a bounded queue, and one writer appends the blocks of the partitions in their order. Nothing is
+    # staged on disk and at most queue_size blocks per partition are held in memory.
+    @staticmethod
+    def assemble_files(files, results, processes=1, queue_size=4):
+        files = collections.deque(files)
+        running = collections.deque()
+        progress = tqdm(total=len(files), desc='Assemble category results in one file:')
+
+        def start():
+            queue = multiprocessing.Queue(queue_size)
+            process = multiprocessing.Process(target=decompress_blocks, args=(files.popleft(), queue))
+            process.start()
+            running.append((process, queue))
+        try:
+            with open(results, 'ab') as outfile:
+                while files and len(running) < processes:
+                    start()
+                while running:
+                    process, queue = running.popleft()
+                    for block in iter(queue.get, None):
+                        if isinstance(block, Exception):
+                            raise block
+                        outfile.write(block)
+                    process.join()
+                    progress.update()
+                    if files:
+                        start()
+        finally:
+            for process, queue in running:
+                process.terminate()
+            progress.close()
+
+    # Hash partitioned: authors are spread over buckets, which are deduplicated in parallel (see externalDedup).
+    def remove_duplicate_authors(self, buckets=64):
+        processes = self.project.get_parallel_processes() or 1
+        results = os.path.join(self.project.data_path, 'author_info_processed' + self.ext)
+        if self.ext == '.parquet':
+            dedup_parquet(self.partitions('author_info.parquet'), results, 'author_info', buckets, processes)
+        else:
+            dedup_lines(self.partitions('author_info.csv'), results, buckets, processes)
+
+    # Sorted array of the distinct revision ids in a relevant_revisions.csv, 8 bytes per relevant revision.
+    @staticmethod
+    def relevant_revision_ids(relevant_revs_file, chunksize=10000000):
+        ids = [np.unique(chunk['rev_id'].to_numpy(dtype=np.int64))
+               for chunk in pd.read_csv(relevant_revs_file, delimiter='\t', names=['rev_id'], chunksize=chunksize)]
+        if not ids:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(ids))
+
+    # Vectorized membership test of revision ids against the sorted relevant ids (binary search).
+    @staticmethod
+    def is_relevant(rev_ids, relevant):
+        if len(relevant) == 0:
+            return np.zeros(len(rev_ids), dtype=bool)
+        positions = np.searchsorted(relevant, rev_ids)
+        positions[positions == len(relevant)] = 0
+        return relevant[positions] == rev_ids
+
+    # Streaming semi-join: only the relevant revision ids of one dump file are held in memory, its
+    # revisions are read in chunks and the relevant ones appended to the results.
+    def update_revisions_file(self, chunksize=1000000):
+        if self.ext == '.parquet':
+            with ParquetTableWriter(os.path.join(self.project.data_path, 'revisions_processed.parquet'),
+                                    'revisions') as writer:
+                for relevant_revs_file, rev_data_file in self.revision_partitions('revisions.parquet'):
+                    relevant_revs = self.relevant_revision_ids(relevant_revs_file)
+                    for table in iter_tables(rev_data_file):
+                        mask = self.is_relevant(table['rev_id'].to_numpy(), relevant_revs)
+                        writer.write_table(table.filter(pa.array(mask)))
+            return
         results = os.path.join(self.project.data_path, 'revisions_processed.csv')
-        rev_data.to_csv(results, sep='\t', index=False, header=False, mode='w')
+        if os.path.isfile(results):
+            os.remove(results)
+        # The relevant revisions of a dump file are all in its own revisions partition, so they are
+        # filtered one partition at a time.
+        for relevant_revs_file, rev_data_file in self.revision_partitions():
+            relevant_revs = self.relevant_revision_ids(relevant_revs_file)
+            # All but the revision id stay text, so every chunk is written exactly as it was read.
+            for rev_data in pd.read_csv(rev_data_file, delimiter='\t',
+                                        names=['page_id', 'rev_id', 'ts', 'author_id', 'epoch'],
+                                        dtype={'page_id': str, 'ts': str, 'author_id': str, 'epoch': str},
+                                        na_filter=False, chunksize=chunksize):
+                rev_data = rev_data[self.is_relevant(rev_data['rev_id'].to_numpy(dtype=np.int64), relevant_revs)]
+                rev_data.to_csv(results, sep='\t', index=False, header=False, mode='a')
 
     def group_links_files(self):
         results_path = os.path.join(self.project.data_path, 'links_all')
         if not os.path.isdir(results_path):
             os.makedirs(results_path)
-        for key, value in tqdm(self.project.pinfo['dump'].items(), desc='Group Link Results:'):
-            path = os.path.join(self.project.results_path, key[:-3])
-            f = 'links.csv.7z'
-            source = os.path.join(path, f)
-            destination = os.path.join(results_path, key[:-3] + '_' + f)
-            shutil.copy2(source, destination)
+        links = []
+        for key in self.project.pinfo['dump']:
+            path = os.path.join(self.project.results_path, os.path.splitext(key)[0])
+            if self.ext == '.parquet':
+                source = os.path.join(path, 'links.parquet')
+            else:
+                source = find_results(path, 'links.csv')
+            if source is not None and os.path.isfile(source):
+                links.append((source, os.path.join(results_path, os.path.splitext(key)[0] + '_' +
+                                                   os.path.basename(source))))
+        # Hard links or reflinks where possible (see link_or_copy), the copies otherwise run in parallel threads.
+        with ThreadPool(self.project.get_parallel_processes() or 1) as pool:
+            for _ in tqdm(pool.imap_unordered(lambda link: link_or_copy(*link), links), total=len(links),
+                          desc='Group Link Results:'):
+                pass
 
     def group_page_info(self):
-        shutil.copy2(os.path.join(self.project.results_path, 'page_info.csv'),
-                     os.path.join(self.project.data_path, 'page_info.csv'))
+        if self.ext == '.parquet':
+            concat_files(self.partitions('page_info.parquet'),
+                         os.path.join(self.project.data_path, 'page_info.parquet'), 'page_info')
+            return
+        with open(os.path.join(self.project.data_path, 'page_info.csv'), 'wb') as outfile:
+            for f in self.partitions('page_info.csv'):
+                with open(f, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, 16777216)
+
+    # Revert markers of all dump files in one file, in the same order as the category results.
+    def group_revert_markers(self):
+        files = [os.path.join(self.project.results_path, os.path.splitext(key)[0], 'reverts' + self.ext)
+                 for key in self.project.pinfo['dump']]
+        files = [f for f in files if os.path.isfile(f)]
+        results = os.path.join(self.project.data_path, 'reverts' + self.ext)
+        if self.ext == '.parquet':
+            concat_files(files, results, 'reverts')
+            return
+        with open(results, 'wb') as outfile:
+            for f in files:
+                with open(f, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, 16777216)
 
-    def combine_old_and_new(self, path=None, cats=None, links=None, page_info=None, revisions=None):
-        dtype = str
+    # Merges the titles of all dump files into titles.csv (target_id, title) and resolves the ids to pages:
+    # title_pages.csv has the title id and page id of every page, so links and categories join pages by id.
+    def build_title_index(self):
+        files = [os.path.join(self.project.results_path, os.path.splitext(key)[0], 'titles.csv')
+                 for key in self.project.pinfo['dump']]
+        titles_file = os.path.join(self.project.data_path, 'titles.csv')
+        collisions = merge_titles([f for f in files if os.path.isfile(f)], titles_file)
+        if collisions > 0:
+            print(str(collisions) + ' titles have the same id as another title. The first title is kept.')
+        page_file = os.path.join(self.project.data_path, 'page_info' + self.ext)
+        results = os.path.join(self.project.data_path, 'title_pages' + self.ext)
+        if self.ext == '.parquet':
+            convert_results(titles_file, os.path.join(self.project.data_path, 'titles.parquet'), 'titles')
+            os.remove(titles_file)
+            with ParquetTableWriter(results, 'title_pages') as writer:
+                for frame in iter_frames(page_file, columns=['page_id', 'title']):
+                    writer.write_frame(pd.DataFrame({'target_id': frame['title'].map(title_id),
+                                                     'page_id': frame['page_id']}))
+            return
+        if os.path.isfile(results):
+            os.remove(results)
+        for chunk in pd.read_csv(page_file, delimiter='\t', header=None, usecols=[0, 1], names=['id', 'title'],
+                                 dtype={'title': str}, na_filter=False, chunksize=1000000):
+            title_pages = pd.DataFrame({'target_id': chunk['title'].map(title_id), 'page_id': chunk['id']})
+            title_pages.to_csv(results, sep='\t', index=False, header=False, mode='a')
+
+    # Merges the results of an earlier run (in path) with the results of this run. Each result is sorted by its
+    # key and merged in one pass (see ExternalMerge), with at most memory bytes of lines held at a time:
+    # cats and links by page, revision and target without duplicate rows, revisions by revision id and
+    # page_info by page id, keeping the row of the earlier run for ids in both. Results are read and written in
+    # the output format of the project, old results in either format.
+    def combine_old_and_new(self, path=None, cats=None, links=None, page_info=None, revisions=None,
+                            memory=1073741824):
+        # Events only hold the changes since the previous revision of the page within one run.
+        assert self.project.get_link_output() == 'full' or (cats is None and links is None), \
+            "Categories and links of link output 'delta' can not be combined with other results."
         if path is None:
             path = '/'
+        old_path = os.path.join(self.project.data_path, path)
+        ext = self.ext
+        cats_name, links_name = ('cat_ids', 'link_ids') if self.title_ids else ('cats', 'links')
         if cats is not None:
-            old_file = os.path.join(self.project.data_path, path, cats)
-            new_file = os.path.join(self.project.data_path, 'cats_all.csv')
-            results_file = os.path.join(self.project.data_path, 'cats_combined.csv')
-            if os.path.isfile(old_file) and os.path.isfile(new_file):
-                chunksize = 1000000
-                for chunk in pd.read_csv(old_file, delimiter='\t', header=None, dtype=dtype, na_filter=False, chunksize=chunksize):
-                    chunk.to_csv(results_file, sep='\t', index=False, header=False, mode='a')
-                for chunk in pd.read_csv(new_file, delimiter='\t', header=None, dtype=dtype, na_filter=False, chunksize=chunksize):
-                    chunk.to_csv(results_file, sep='\t', index=False, header=False, mode='a')
-            else:
-                print('New or old categories file does not exist in the expected location')
+            self.combine([os.path.join(old_path, cats)], [os.path.join(self.project.data_path, 'cats_all' + ext)],
+                         'cats_combined', link_key, lambda line: line, memory, self.cleaned_lines, cats_name)
         if revisions is not None:
-            old_file = os.path.join(self.project.data_path, path, revisions)
-            new_file = os.path.join(self.project.data_path, 'revisions_processed.csv')
-            results_file = os.path.join(self.project.data_path, 'revisions_combined.csv')
-            if os.path.isfile(old_file) and os.path.isfile(new_file):
-                chunksize = 1000000
-                for chunk in pd.read_csv(old_file, delimiter='\t', header=None, dtype=dtype, na_filter=False, chunksize=chunksize):
-                    chunk.to_csv(results_file, sep='\t', index=False, header=False, mode='a')
-                for chunk in pd.read_csv(new_file, delimiter='\t', header=None, dtype=dtype, na_filter=False, chunksize=chunksize):
-                    chunk.to_csv(results_file, sep='\t', index=False, header=False, mode='a')
-
-            else:
-                print('New or old revisions file does not exist in the expected location')
+            self.combine([os.path.join(old_path, revisions)],
+                         [os.path.join(self.project.data_path, 'revisions_processed' + ext)],
+                         'revisions_combined', revision_key, revision_key, memory, self.lines_with_epoch,
+                         'revisions')
         if page_info is not None:
-            old_file = os.path.join(self.project.data_path, path, page_info)
-            new_file = os.path.join(self.project.data_path, 'page_info.csv')
-            results_file = os.path.join(self.project.data_path, 'page_info_combined.csv')
-            if os.path.isfile(old_file) and os.path.isfile(new_file):
-                chunksize = 1000000
-                for chunk in pd.read_csv(old_file, delimiter='\t', header=None, dtype=dtype, na_filter=False, chunksize=chunksize):
-                    chunk.to_csv(results_file, sep='\t', index=False, header=False, mode='a')
-                for chunk in pd.read_csv(new_file, delimiter='\t', header=None, dtype=dtype, na_filter=False, chunksize=chunksize):
-                    chunk.to_csv(results_file, sep='\t', index=False, header=False, mode='a')
-
-                #remove duplicates
-                dtypes = {
-                    'id': int,
-                    'title': str,
-                    'ns': str,
-                    'date': str
-                }
-                print('Drop duplicates')
-                page_info = pd.read_csv(results_file, delimiter='\t', header=None,
-                                        names=['id', 'title', 'ns', 'date'], dtype=dtypes, na_filter=False)
-                results = page_info.drop_duplicates(subset=['id'], keep='first')
-                results.to_csv(results_file, sep='\t', index=False, header=False, mode='w')
-
-            else:
-                print('New or old revisions file does not exist in the expected location')
+            self.combine([os.path.join(old_path, page_info)], [os.path.join(self.project.data_path, 'page_info' + ext)],
+                         'page_info_combined', page_key, page_key, memory, name='page_info')
         if links is not None:
-            print('HANDLING of Links is not yet implemented')
+            if isinstance(links, str):
+                links = [links]
+            new_links = sorted(glob.glob(os.path.join(self.project.data_path, 'links_all', '*')))
+            self.combine([os.path.join(old_path, f) for f in links], new_links, 'links_combined',
+                         link_key, lambda line: line, memory, self.cleaned_lines, links_name)
+
+    # Parquet results (name is their schema, see parquetOutput) are merged as lines and converted back.
+    def combine(self, old_files, new_files, results, key, dedup_key, memory, old_lines=None, name=None):
+        missing = [f for f in old_files + new_files if not os.path.isfile(f)]
+        if missing or not new_files:
+            print('New or old ' + results.split('_')[0] + ' file does not exist in the expected location: ' +
+                  ', '.join(missing))
+            return
+        results = os.path.join(self.project.data_path, results)
+        merge = ExternalMerge(results + '.csv', key, dedup_key, memory)
+        for f in old_files:
+            lines = self.result_lines(f, merge.tmp_path)
+            merge.add(old_lines(lines) if old_lines is not None else lines)
+        for f in new_files:
+            merge.add(self.result_lines(f, merge.tmp_path))
+        merge.finish()
+        if self.ext == '.parquet':
+            convert_lines(results + '.csv', results + '.parquet', name)
+            os.remove(results + '.csv')
+
+    @staticmethod
+    def result_lines(f, tmp_path):
+        if f.endswith('.parquet'):
+            return table_lines(f)
+        return read_lines(f, tmp_path)
+
+    # Older runs did not normalize the titles of categories and links.
+    @staticmethod
+    def cleaned_lines(lines, chunksize=1000000):
+        lines = iter(lines)
+        while True:
+            batch = ''.join(itertools.islice(lines, chunksize))
+            if not batch:
+                return
+            chunk = pd.read_csv(io.StringIO(batch), delimiter='\t', header=None, dtype=str, na_filter=False)
+            chunk = Processor.clean_labels(chunk, 2)
+            for line in chunk.to_csv(sep='\t', index=False, header=False).splitlines(True):
+                yield line
+
+    # Revisions of older runs have no epoch column yet.
+    @staticmethod
+    def lines_with_epoch(lines):
+        for line in lines:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 4:
+                line = line.rstrip('\n') + '\t' + str(epoch_timestamp(fields[2])) + '\n'
+            yield line
 
     def combine_parsed_results(self, remove=False):
         destination = "parsed_results"
         parsed_files = {}
 
-        parsed_files['page_info'] = 'page_info.csv'
-        parsed_files['author_info'] = 'author_info.csv'
-        parsed_files['revisions'] = 'revisions.csv'
-        parsed_files['cats'] = 'cats.csv'
+        ext = self.ext
+        parsed_files['page_info'] = 'page_info' + ext
+        parsed_files['author_info'] = 'author_info' + ext
+        parsed_files['revisions'] = 'revisions' + ext
+        parsed_files['cats'] = 'cats' + ext
 
         try:
             os.mkdir(destination)
@@ -140,29 +332,46 @@ class ProcessorResults:
 
         # move page_info file
         try:
-            shutil.move(os.path.join(self.project.data_path, 'page_info.csv'), os.path.join(destination, 'page_info.csv'))
+            shutil.move(os.path.join(self.project.data_path, 'page_info' + ext),
+                        os.path.join(destination, 'page_info' + ext))
         except:
             pass
         # move author_info file
         try:
-            shutil.move(os.path.join(self.project.data_path, 'author_info_processed.csv'),
-                        os.path.join(destination, 'author_info.csv'))
+            shutil.move(os.path.join(self.project.data_path, 'author_info_processed' + ext),
+                        os.path.join(destination, 'author_info' + ext))
         except:
             pass
 
         # move revision file
         try:
-            shutil.move(os.path.join(self.project.data_path, 'revisions_processed.csv'), os.path.join(destination, 'revisions.csv'))
+            shutil.move(os.path.join(self.project.data_path, 'revisions_processed' + ext),
+                        os.path.join(destination, 'revisions' + ext))
         except:
             pass
 
         # move cats file
         try:
-            shutil.move(os.path.join(self.project.data_path, 'cats_all.csv'),
-                        os.path.join(destination, 'cats.csv'))
+            shutil.move(os.path.join(self.project.data_path, 'cats_all' + ext),
+                        os.path.join(destination, 'cats' + ext))
         except:
             pass
 
+        # move revert markers
+        if os.path.isfile(os.path.join(self.project.data_path, 'reverts' + ext)):
+            shutil.move(os.path.join(self.project.data_path, 'reverts' + ext),
+                        os.path.join(destination, 'reverts' + ext))
+            parsed_files['reverts'] = 'reverts' + ext
+
+        # move title dictionary and its pages
+        if self.title_ids:
+            for f in ('titles', 'title_pages'):
+                try:
+                    shutil.move(os.path.join(self.project.data_path, f + ext), os.path.join(destination, f + ext))
+                    parsed_files[f] = f + ext
+                except:
+                    pass
+
         # move links files
         try:
             os.rename(os.path.join(self.project.data_path, 'links_all'), os.path.join(self.project.data_path, 'links'))
@@ -173,7 +382,7 @@ class ProcessorResults:
 
         try:
             link_files = []
-            for file in glob.glob(os.path.join(destination, 'links', '*')):
+            for file in sorted(glob.glob(os.path.join(destination, 'links', '*'))):
                 f = os.path.split(file)[1]
                 link_files.append(f)
             parsed_files['links'] = link_files
@@ -0,0 +1,134 @@
+import os
+import glob
+import lzma
+import fcntl
+import shutil
+from pyunpack import Archive
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ioctl of Linux that clones a file on copy-on-write filesystems (btrfs, xfs, ...).
+FICLONE = 0x40049409
+
+# File extension of every codec results can be written with.
+EXTENSIONS = {
+    'xz': '.xz',
+    'zstd': '.zst'
+}
+
+
+def require(codec):
+    assert codec in EXTENSIONS, "Compression needs to be 'xz' or 'zstd'."
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError('zstd compression needs zstandard (pip install zstandard).')
+
+
+def open_results(path, mode='rt', preset=1, level=3):
+    """Opens a results file, compressed or not, as a stream. The codec follows from the extension:
+    .xz (lzma, stdlib), .zst (zstandard) or none. Text modes read and write UTF-8.
+    """
+    encoding = 'utf-8' if 't' in mode else None
+    if path.endswith('.xz'):
+        if 'w' in mode or 'a' in mode:
+            return lzma.open(path, mode, preset=preset, encoding=encoding)
+        return lzma.open(path, mode, encoding=encoding)
+    if path.endswith('.zst'):
+        require('zstd')
+        if 'w' in mode or 'a' in mode:
+            return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=level, threads=-1), encoding=encoding)
+        return zstandard.open(path, mode, encoding=encoding)
+    return open(path, mode, encoding=encoding, buffering=8388608)
+
+
+def find_results(path, f):
+    """Returns the results file f in path as it was written: compressed by any codec, as a 7z archive
+    (results of older versions) or plain. None if there is none.
+    """
+    for ext in list(EXTENSIONS.values()) + ['.7z', '']:
+        if os.path.isfile(os.path.join(path, f + ext)):
+            return os.path.join(path, f + ext)
+    return None
+
+
+def compress_file(path, compressed_path, chunk_size=16777216):
+    with open(path, 'rb') as infile, open_results(compressed_path, 'wb') as outfile:
+        shutil.copyfileobj(infile, outfile, chunk_size)
+    os.remove(path)
+    return compressed_path
+
+
+def read_lines(path, tmp_path):
+    """Yields the lines of a results file, each ending with a line break. Compressed files are read as a
+    stream, 7z archives of older versions are unpacked to tmp_path while they are read.
+    """
+    unpacked = None
+    if path.endswith('.7z'):
+        unpacked = os.path.join(tmp_path, 'unpacked')
+        if os.path.isdir(unpacked):
+            shutil.rmtree(unpacked)
+        Archive(path).extractall(unpacked, auto_create_dir=True)
+        path = glob.glob(os.path.join(unpacked, '*'))[0]
+    try:
+        with open_results(path, 'rt') as infile:
+            for line in infile:
+                if not line.endswith('\n'):
+                    line += '\n'
+                yield line
+    finally:
+        if unpacked is not None:
+            shutil.rmtree(unpacked)
+
+
+def decompress_blocks(path, queue, block_size=16777216):
+    """Puts the decompressed content of the results file path (found by find_results) on queue in blocks of up
+    to block_size bytes, followed by None. An error is put on the queue instead of raised.
+    """
+    try:
+        if path.endswith('.7z'):
+            blocks = (line.encode('utf-8') for line in read_lines(path, os.path.dirname(path)))
+            block = []
+            size = 0
+            for line in blocks:
+                block.append(line)
+                size += len(line)
+                if size >= block_size:
+                    queue.put(b''.join(block))
+                    block = []
+                    size = 0
+            if block:
+                queue.put(b''.join(block))
+        else:
+            last = b'\n'
+            with open_results(path, 'rb') as infile:
+                for block in iter(lambda: infile.read(block_size), b''):
+                    queue.put(block)
+                    last = block[-1:]
+            if last != b'\n':
+                queue.put(b'\n')
+        queue.put(None)
+    except Exception as e:
+        queue.put(e)
+
+
+def link_or_copy(source, destination):
+    """Puts source at destination without copying the data where the filesystem allows: as a hard link, else
+    as a reflink (clone), else as a copy. Results are not changed once written, so sharing them is safe.
+    """
+    if os.path.isfile(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return destination
+    except OSError:
+        pass
+    try:
+        with open(source, 'rb') as infile, open(destination, 'wb') as outfile:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+        shutil.copystat(source, destination)
+        return destination
+    except OSError:
+        pass
+    return shutil.copy2(source, destination)
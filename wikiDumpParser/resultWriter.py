@@ -0,0 +1,217 @@
+import os
+import shutil
+import io
+import csv
+import time
+from wikiDumpParser.parquetOutput import ParquetBuffer
+
+
+class RowBuffer(object):
+    """Collects the rows of one result table and appends them to its tab separated file in batches.
+
+    Rows are flushed once max_rows rows or roughly max_bytes characters are buffered. They are
+    quoted the same way pandas' to_csv quotes them, so the files can still be read with read_csv.
+    """
+    def __init__(self, path, max_rows=100000, max_bytes=16777216):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, delimiter='\t', lineterminator='\n')
+        self.pending = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def append(self, row):
+        self.writer.writerow(row)
+        self.pending += 1
+        if self.pending >= self.max_rows or self.buffer.tell() >= self.max_bytes:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def flush(self):
+        if self.pending == 0:
+            return
+        data = self.buffer.getvalue().encode('utf-8')
+        with open(self.path, 'ab') as outfile:
+            outfile.write(data)
+        self.rows += self.pending
+        self.bytes += len(data)
+        self.pending = 0
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        self.flush()
+
+
+class ResultSink(object):
+    """Keeps a per-file result file (cats.csv, links.csv) open with a large buffer for a whole parse() call.
+
+    Counts the rows and bytes written so the throughput of a run can be reported. A parse always starts
+    from scratch, so rows of an earlier, failed attempt are overwritten.
+    """
+    def __init__(self, path, buffer_size=8388608):
+        self.path = path
+        self.file = open(path, 'wb', buffering=buffer_size)
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.time()
+
+    def write(self, *fields):
+        data = ('\t'.join(fields) + '\n').encode('utf-8')
+        self.file.write(data)
+        self.rows += 1
+        self.bytes += len(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def report(self):
+        seconds = max(time.time() - self.started, 0.001)
+        return '%s: %d rows, %.1f MB, %.0f rows/s, %.2f MB/s' % (self.path, self.rows, self.bytes / 1048576.0,
+                                                                 self.rows / seconds,
+                                                                 self.bytes / 1048576.0 / seconds)
+
+
+class ResultWriter(object):
+    """Row buffers for the result tables and sinks for the link and category results of one dump file.
+
+    Each table and sink is available as an attribute (e.g. writer.revisions.append(row) or
+    writer.links.write(page_id, rev_id, target)). Used as a context manager everything is flushed
+    and closed on exit, also if parsing fails.
+
+    Every dump file writes its own partition of the tables, to <results_path>/tables.tmp while it is
+    parsed. commit() renames it to <results_path>/tables, so a partition is either complete or missing
+    and parallel workers never append to the same file.
+
+    With output_format 'parquet' the tables are written as Parquet files (see ParquetBuffer) instead.
+    """
+    tables = {
+        'page_info': 'page_info.csv',
+        'revisions': 'revisions.csv',
+        'author_info': 'author_info.csv',
+        'no_text_error': 'no_text_error.csv'
+    }
+
+    sinks = {
+        'cats': 'cats.csv',
+        'links': 'links.csv',
+        'reverts': 'reverts.csv',
+        'titles': 'titles.csv'
+    }
+
+    partition = 'tables'
+
+    def __init__(self, results_path, output_format='csv', **buffer_options):
+        self.results_path = results_path
+        self.output_format = output_format
+        self.partition_path = os.path.join(results_path, self.partition)
+        self.tmp_path = self.partition_path + '.tmp'
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        for name, f in self.tables.items():
+            if output_format == 'parquet':
+                buffer = ParquetBuffer(os.path.join(self.tmp_path, name + '.parquet'), name, **buffer_options)
+            else:
+                buffer = RowBuffer(os.path.join(self.tmp_path, f), **buffer_options)
+            setattr(self, name, buffer)
+        for name, f in self.sinks.items():
+            setattr(self, name, ResultSink(os.path.join(results_path, f)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def buffers(self):
+        return [getattr(self, name) for name in self.tables]
+
+    def outputs(self):
+        return [getattr(self, name) for name in self.sinks]
+
+    # Called after every page, so the per-file results on disk are complete up to the last finished page.
+    def end_page(self):
+        for sink in self.outputs():
+            sink.flush()
+
+    def flush(self):
+        for buffer in self.buffers():
+            buffer.flush()
+        self.end_page()
+
+    def close(self):
+        try:
+            for buffer in self.buffers():
+                buffer.close()
+        finally:
+            for sink in self.outputs():
+                sink.close()
+
+    def commit(self):
+        self.close()
+        if os.path.isdir(self.partition_path):
+            shutil.rmtree(self.partition_path)
+        os.rename(self.tmp_path, self.partition_path)
+
+    # Writes the rows collected by a RowCollector (e.g. in a worker process).
+    def add_rows(self, collector):
+        for name in self.tables:
+            getattr(self, name).extend(getattr(collector, name))
+        for name in self.sinks:
+            sink = getattr(self, name)
+            for fields in getattr(collector, name):
+                sink.write(*fields)
+
+    def report(self):
+        return '\n'.join(sink.report() for sink in self.outputs())
+
+
+class SeenSet(object):
+    """Keys of rows that were written already, to skip writing them again.
+
+    Once max_size keys are held the set is cleared, so memory stays bounded and a key can be written
+    again. Only use it for rows that are deduplicated later anyway (a size of 0 keeps nothing).
+    """
+    def __init__(self, max_size=1000000):
+        self.max_size = max_size
+        self.keys = set()
+
+    # Returns whether the key is new and remembers it.
+    def add(self, key):
+        if key in self.keys:
+            return False
+        if self.max_size <= 0:
+            return True
+        if len(self.keys) >= self.max_size:
+            self.keys.clear()
+        self.keys.add(key)
+        return True
+
+
+class RowList(list):
+    """List of rows with the write() method of a ResultSink."""
+    def write(self, *fields):
+        self.append(fields)
+
+
+class RowCollector(object):
+    """Same tables and sinks as a ResultWriter, but the rows are only collected in memory.
+
+    Lets get_data() run in a worker process and the rows be written by ResultWriter.add_rows() in the parent.
+    """
+    def __init__(self):
+        for name in list(ResultWriter.tables) + list(ResultWriter.sinks):
+            setattr(self, name, RowList())
+        # Link cache lookups of the worker for these rows (see LinkCache).
+        self.link_cache_hits = 0
+        self.link_cache_misses = 0
@@ -0,0 +1,87 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from wikiDumpParser.processorData import Processor
+
+# Stage that processes a file with this status and the status while the stage runs.
+STAGES = {
+    'init': ('download', 'download_started'),
+    'downloaded': ('decompress', 'splitting_started'),
+    'split': ('parse', 'parsing_started'),
+    'parsed': ('postprocess', 'postprocessing_started')
+}
+
+
+def run_stage(file_name, data_path, base_url, status, start_date, md5, options):
+    return Processor(file_name, data_path, base_url, status, start_date, md5, **options).process()
+
+
+class Scheduler(object):
+    """Runs the processing stages of all dump files in a pipeline.
+
+    Every stage (download, decompress, parse, postprocess) has its own pool with its own limit of
+    concurrently processed files and a queue of files waiting for it. A file moves on to the queue of
+    the next stage as soon as a stage is done, so downloads, decompression and parsing overlap instead
+    of taking turns. Downloads run in threads, all other stages in processes. Status changes are only
+    saved by the scheduler.
+    """
+    def __init__(self, project, limits):
+        self.project = project
+        self.limits = limits
+        self.queues = {stage: deque() for stage, running_status in STAGES.values()}
+        self.running = {}
+
+    def pools(self):
+        pools = {}
+        for stage, limit in self.limits.items():
+            if stage == 'download':
+                pools[stage] = ThreadPoolExecutor(max_workers=limit)
+            else:
+                pools[stage] = ProcessPoolExecutor(max_workers=limit)
+        return pools
+
+    def active(self, stage):
+        return sum(1 for running_stage, f, status in self.running.values() if running_stage == stage)
+
+    def enqueue(self, f, status):
+        if status in STAGES:
+            self.queues[STAGES[status][0]].append((f, status))
+
+    def submit(self, pools):
+        pinfo = self.project.pinfo
+        options = self.project.processor_options()
+        for stage, queue in self.queues.items():
+            while queue and self.active(stage) < self.limits[stage]:
+                f, status = queue.popleft()
+                print('Call next Processor for ' + status + ' file: ' + f)
+                self.project.set_file_status(f, STAGES[status][1])
+                future = pools[stage].submit(run_stage, f, self.project.data_path, pinfo['base_url'], status,
+                                             pinfo['start_date'], pinfo['md5'][f], options)
+                self.running[future] = (stage, f, status)
+
+    def run(self):
+        for f, status in self.project.pinfo['dump'].items():
+            self.enqueue(f, status)
+        pools = self.pools()
+        try:
+            self.submit(pools)
+            while self.running:
+                done, not_done = wait(list(self.running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, f, status = self.running.pop(future)
+                    try:
+                        new_status = future.result()
+                    except Exception as e:
+                        print('Error in ' + stage + ' of ' + f + ': ' + str(e))
+                        new_status = 'error'
+                    if new_status is None:
+                        new_status = 'error'
+                    # Like cleanup() after an interruption: what the stage left is removed, so a retry starts
+                    # over from the download. Partial downloads are kept and resumed.
+                    if new_status == 'error' and stage != 'download':
+                        self.project.remove_file_data(f)
+                    self.project.set_file_status(f, new_status)
+                    self.enqueue(f, new_status)
+                self.submit(pools)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
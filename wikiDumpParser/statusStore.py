@@ -0,0 +1,113 @@
+import sqlite3
+import time
+
+
+class StatusStore(object):
+    """Processing status of the dump files in an SQLite database.
+
+    Every status change is a single transaction on one row, so parallel workers can update their files
+    without rewriting the project file or losing each other's updates. Each file keeps the time of its
+    last change and the number of attempts (stages started), and every change is logged in history.
+    """
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, status TEXT NOT NULL, md5 TEXT, '
+                       'attempts INTEGER NOT NULL DEFAULT 0, updated REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS history (name TEXT NOT NULL, old_status TEXT, '
+                       'new_status TEXT NOT NULL, time REAL NOT NULL)')
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    # Used as context manager a connection commits the transaction, but is not closed.
+    def execute(self, statement, parameters=()):
+        db = self.connect()
+        try:
+            with db:
+                return db.execute(statement, parameters).rowcount
+        finally:
+            db.close()
+
+    def query(self, statement, parameters=()):
+        db = self.connect()
+        try:
+            return db.execute(statement, parameters).fetchall()
+        finally:
+            db.close()
+
+    # files: {name: md5}. Files that are already known keep their status.
+    def add_files(self, files, status='init'):
+        db = self.connect()
+        try:
+            with db:
+                db.executemany('INSERT OR IGNORE INTO files (name, status, md5, updated) VALUES (?, ?, ?, ?)',
+                               [(name, status, md5, time.time()) for name, md5 in files.items()])
+        finally:
+            db.close()
+
+    # statuses: {name: status}, e.g. the statuses of a project from before the store existed.
+    def import_statuses(self, statuses, md5s):
+        db = self.connect()
+        try:
+            with db:
+                db.executemany('INSERT OR IGNORE INTO files (name, status, md5, updated) VALUES (?, ?, ?, ?)',
+                               [(name, status, md5s.get(name), time.time()) for name, status in statuses.items()])
+        finally:
+            db.close()
+
+    # Sets the status of a file. If old_status is given, only a file with that status is changed.
+    # Returns whether the file was changed.
+    def set_status(self, name, status, old_status=None):
+        db = self.connect()
+        try:
+            with db:
+                now = time.time()
+                started = 1 if status.endswith('_started') else 0
+                if old_status is None:
+                    changed = db.execute('UPDATE files SET status = ?, attempts = attempts + ?, updated = ? '
+                                         'WHERE name = ?', (status, started, now, name)).rowcount
+                else:
+                    changed = db.execute('UPDATE files SET status = ?, attempts = attempts + ?, updated = ? '
+                                         'WHERE name = ? AND status = ?',
+                                         (status, started, now, name, old_status)).rowcount
+                if changed:
+                    db.execute('INSERT INTO history (name, old_status, new_status, time) VALUES (?, ?, ?, ?)',
+                               (name, old_status, status, now))
+                return changed == 1
+        finally:
+            db.close()
+
+    # Sets all files with one of the old statuses to status in one transaction. Returns their names.
+    def set_all(self, old_statuses, status):
+        db = self.connect()
+        try:
+            with db:
+                marks = ', '.join('?' * len(old_statuses))
+                names = [row[0] for row in db.execute('SELECT name FROM files WHERE status IN (' + marks + ')',
+                                                      tuple(old_statuses))]
+                now = time.time()
+                db.execute('UPDATE files SET status = ?, updated = ? WHERE status IN (' + marks + ')',
+                           (status, now) + tuple(old_statuses))
+                db.executemany('INSERT INTO history (name, old_status, new_status, time) VALUES (?, NULL, ?, ?)',
+                               [(name, status, now) for name in names])
+                return names
+        finally:
+            db.close()
+
+    def names(self, statuses):
+        marks = ', '.join('?' * len(statuses))
+        return [row[0] for row in self.query('SELECT name FROM files WHERE status IN (' + marks + ') ORDER BY rowid',
+                                             tuple(statuses))]
+
+    def statuses(self):
+        return dict(self.query('SELECT name, status FROM files ORDER BY rowid'))
+
+    def md5s(self):
+        return dict(self.query('SELECT name, md5 FROM files ORDER BY rowid'))
+
+    def counts(self):
+        return dict(self.query('SELECT status, COUNT(*) FROM files GROUP BY status'))
@@ -0,0 +1,67 @@
+import os
+import shutil
+import hashlib
+from wikiDumpParser.resultWriter import SeenSet
+
+
+def title_id(title):
+    """Stable integer id of a normalized title: the first 8 bytes of its blake2b hash as a signed int64.
+
+    Every process computes the same id for the same title without any coordination, so ids from parallel
+    workers, different dump files and different runs can be joined directly. Page titles in the dumps are
+    already normalized, so title_id(page title) is the id of all links and categories pointing to the page.
+    """
+    return int.from_bytes(hashlib.blake2b(title.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+class TitleDictionary(object):
+    """Interns link and category targets as title ids and writes every new title once to a sink.
+
+    The ids written by a worker are kept in a SeenSet of max_size ids. Titles written again after it was
+    cleared only cost space: the titles of all dictionaries are merged (and duplicates dropped) by merge_titles.
+    """
+    def __init__(self, max_size=2000000):
+        self.seen = SeenSet(max_size)
+
+    # Returns the ids of the titles as strings and writes the titles not seen yet to sink as (id, title).
+    def intern(self, titles, sink):
+        ids = []
+        for title in titles:
+            i = title_id(title)
+            if self.seen.add(i):
+                sink.write(str(i), title)
+            ids.append(str(i))
+        return ids
+
+
+# Merges titles.csv files of several dictionaries into one file with one row per id. The rows are spread
+# over buckets by id first, so only one bucket is held in memory at a time. Returns the number of
+# collisions (one id for different titles), where the first title is kept.
+def merge_titles(files, path, buckets=64):
+    bucket_path = path + '.buckets'
+    if os.path.isdir(bucket_path):
+        shutil.rmtree(bucket_path)
+    os.makedirs(bucket_path)
+    outputs = [open(os.path.join(bucket_path, str(i)), 'w', encoding='utf-8') for i in range(buckets)]
+    try:
+        for f in files:
+            with open(f, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    outputs[int(line.split('\t', 1)[0]) % buckets].write(line)
+    finally:
+        for output in outputs:
+            output.close()
+    collisions = 0
+    with open(path, 'w', encoding='utf-8') as outfile:
+        for i in range(buckets):
+            titles = {}
+            with open(os.path.join(bucket_path, str(i)), 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    key, title = line.rstrip('\n').split('\t', 1)
+                    known = titles.setdefault(key, title)
+                    if known != title:
+                        collisions += 1
+            for key, title in titles.items():
+                outfile.write(key + '\t' + title + '\n')
+    shutil.rmtree(bucket_path)
+    return collisions
@@ -7,6 +7,10 @@ import glob
 from datetime import datetime
 from wikiDumpParser.processorData import *
 from wikiDumpParser.processorResults import *
+from wikiDumpParser.scheduler import *
+from wikiDumpParser.statusStore import *
+from wikiDumpParser.linkGraph import build_graphs, GraphStore
+from wikiDumpParser import parquetOutput, resultCodec
 from joblib import Parallel, delayed
 
 
@@ -18,6 +22,8 @@ class Project:
         self.tmp_status_path = os.path.join(self.data_path, 'tmp_status')
         self.pinfo = {}
         self.pinfo_file = os.path.join(self.path, '_project_info.json')
+        self.status_file = os.path.join(self.path, '_status.sqlite')
+        self.status_store = None
         self.pinfo['start_date'] = parser.parse('1990-01-01').timestamp()
         self.pinfo['parallel_processes'] = 1
 
@@ -26,8 +32,6 @@ class Project:
             os.makedirs(os.path.join(os.getcwd(), self.path))
         if not os.path.isdir(os.path.join(os.getcwd(), self.data_path)):
             os.makedirs(os.path.join(os.getcwd(), self.data_path))
-        if not os.path.isdir(os.path.join(os.getcwd(), self.tmp_status_path)):
-            os.makedirs(os.path.join(os.getcwd(), self.tmp_status_path))
         if start_date is not None:
             self.pinfo['start_date'] = parser.parse(start_date).timestamp()
         if dump_date is not None:
@@ -43,28 +47,44 @@ class Project:
             with open(os.path.join(os.getcwd(), self.pinfo_file), 'r') as info_file:
                 self.pinfo = json.load(info_file)
             info_file.close()
+            # Projects from before the status store kept the statuses in the project file.
+            if 'dump' in self.pinfo.keys():
+                self.store().import_statuses(self.pinfo['dump'], self.pinfo.get('md5', {}))
+                self.save_project()
         self.update_status()
 
+    # The statuses and md5 sums of the dump files are kept in the status store, not in the project file.
     def save_project(self):
+        pinfo = {key: value for key, value in self.pinfo.items() if key not in ('dump', 'md5')}
         with open(self.pinfo_file, 'w') as info_file:
-            json.dump(self.pinfo, info_file, sort_keys=True, indent=4)
+            json.dump(pinfo, info_file, sort_keys=True, indent=4)
         return
 
-    def save_tmp_status(self, filename, status):
-        with open(os.path.join(self.tmp_status_path, filename), 'w') as info_file:
-            json.dump(status, info_file, sort_keys=True, indent=4)
-        return
+    def store(self):
+        if self.status_store is None:
+            self.status_store = StatusStore(self.status_file)
+        return self.status_store
 
+    def set_file_status(self, f, status):
+        self.store().set_status(f, status)
+
+    # Reads the statuses of all dump files from the status store into pinfo['dump'].
     def update_status(self):
+        if not os.path.isdir(self.path):
+            return
+        # Status files written by workers of older versions.
         for f in glob.glob(self.tmp_status_path + '/*'):
             with open(os.path.join(os.getcwd(), f), 'r') as info_file:
                 status = json.load(info_file)
-            self.pinfo['dump'][os.path.basename(f)+'.7z'] = status
-            self.save_project()
+            self.set_file_status(os.path.basename(f)+'.7z', status)
             os.remove(f)
+        statuses = self.store().statuses()
+        if statuses:
+            self.pinfo['dump'] = statuses
+            self.pinfo['md5'] = self.store().md5s()
 
     def set_start_date(self, date):
-        self.pinfo['start_date'] = parser.parse(date)
+        self.pinfo['start_date'] = parser.parse(date).timestamp()
         self.save_project()
 
     def get_start_date(self):
@@ -75,7 +95,7 @@ class Project:
             return None
 
     def set_dump_date(self, date):
-        self.pinfo['dump_date'] = parser.parse(date)
+        self.pinfo['dump_date'] = parser.parse(date).timestamp()
         self.save_project()
 
     def get_dump_date(self):
@@ -97,6 +117,130 @@ class Project:
             print('No number of parallel processes has been set.')
             return None
 
+    # Limits of concurrently processed files per stage for the pipelined processing (see Scheduler).
+    # Stages without a limit use the number of parallel processes.
+    def set_stage_limits(self, download=3, decompress=2, parse=None, postprocess=None):
+        limits = {'download': download, 'decompress': decompress, 'parse': parse, 'postprocess': postprocess}
+        for stage, limit in limits.items():
+            if limit is None:
+                limits[stage] = self.pinfo['parallel_processes']
+            assert type(limits[stage]) is int, "Limit of stage " + stage + " is not an integer."
+        self.pinfo['stage_limits'] = limits
+        self.save_project()
+
+    def get_stage_limits(self):
+        if 'stage_limits' in self.pinfo.keys():
+            return self.pinfo['stage_limits']
+        else:
+            print('No stage limits have been set.')
+            return None
+
+    def set_page_workers(self, number):
+        assert type(number) is int, "Number of page workers is not an integer."
+        self.pinfo['page_workers'] = number
+        self.save_project()
+
+    def get_page_workers(self):
+        return self.pinfo.get('page_workers', 1)
+
+    def set_download_segments(self, number):
+        assert type(number) is int, "Number of download segments is not an integer."
+        self.pinfo['download_segments'] = number
+        self.save_project()
+
+    def get_download_segments(self):
+        return self.pinfo.get('download_segments', 1)
+
+    def set_streaming(self, streaming):
+        assert type(streaming) is bool, "Streaming needs to be True or False."
+        self.pinfo['streaming'] = streaming
+        self.save_project()
+
+    def get_streaming(self):
+        return self.pinfo.get('streaming', False)
+
+    def set_parser_mode(self, mode):
+        assert mode in ('tree', 'filter'), "Parser mode needs to be 'tree' or 'filter'."
+        self.pinfo['parser_mode'] = mode
+        self.save_project()
+
+    def get_parser_mode(self):
+        return self.pinfo.get('parser_mode', 'tree')
+
+    def set_link_cache_size(self, number):
+        assert type(number) is int, "Size of the link cache is not an integer."
+        self.pinfo['link_cache_size'] = number
+        self.save_project()
+
+    def get_link_cache_size(self):
+        return self.pinfo.get('link_cache_size', 100000)
+
+    def set_author_cache_size(self, number):
+        assert type(number) is int, "Author cache size is not an integer."
+        self.pinfo['author_cache_size'] = number
+        self.save_project()
+
+    def get_author_cache_size(self):
+        return self.pinfo.get('author_cache_size', 100000)
+
+    def set_revert_markers(self, revert_markers):
+        assert type(revert_markers) is bool, "Revert markers need to be True or False."
+        self.pinfo['revert_markers'] = revert_markers
+        self.save_project()
+
+    def get_revert_markers(self):
+        return self.pinfo.get('revert_markers', False)
+
+    def set_link_output(self, mode):
+        assert mode in ('full', 'delta'), "Link output needs to be 'full' or 'delta'."
+        assert mode == 'full' or self.get_output_format() == 'csv', "Link output 'delta' needs output format 'csv'."
+        self.pinfo['link_output'] = mode
+        self.save_project()
+
+    def get_link_output(self):
+        return self.pinfo.get('link_output', 'full')
+
+    def set_output_format(self, output_format):
+        assert output_format in ('csv', 'parquet'), "Output format needs to be 'csv' or 'parquet'."
+        assert output_format == 'csv' or self.get_link_output() == 'full', \
+            "Output format 'parquet' needs link output 'full'."
+        if output_format == 'parquet':
+            parquetOutput.require()
+        self.pinfo['output_format'] = output_format
+        self.save_project()
+
+    def get_output_format(self):
+        return self.pinfo.get('output_format', 'csv')
+
+    def set_title_ids(self, title_ids):
+        assert type(title_ids) is bool, "Title ids need to be True or False."
+        self.pinfo['title_ids'] = title_ids
+        self.save_project()
+
+    def get_title_ids(self):
+        return self.pinfo.get('title_ids', False)
+
+    def set_compression(self, codec):
+        resultCodec.require(codec)
+        self.pinfo['compression'] = codec
+        self.save_project()
+
+    def get_compression(self):
+        return self.pinfo.get('compression', 'xz')
+
+    def processor_options(self):
+        return {'streaming': self.get_streaming(),
+                'parser_mode': self.get_parser_mode(),
+                'link_cache_size': self.get_link_cache_size(),
+                'revert_markers': self.get_revert_markers(),
+                'link_output': self.get_link_output(),
+                'page_workers': self.get_page_workers(),
+                'download_segments': self.get_download_segments(),
+                'output_format': self.get_output_format(),
+                'title_ids': self.get_title_ids(),
+                'author_cache_size': self.get_author_cache_size(),
+                'compression': self.get_compression()}
+
     def add_dump_file_info(self, file_list, base_url):
         if base_url[-1:] != '/':
             base_url = base_url+'/'
@@ -109,6 +253,7 @@ class Project:
             for f in file_list.iterrows():
                 self.pinfo['dump'][f[1]['name']] = 'init'
                 self.pinfo['md5'][f[1]['name']] = f[1]['md5']
+            self.store().add_files(self.pinfo['md5'])
             self.save_project()
         else:
             print('Dump list has already been added to project.')
@@ -136,6 +281,7 @@ class Project:
                 if bool(value):
                     self.pinfo['dump'][key] = 'init'
                     self.pinfo['md5'][key] = value['md5']
+            self.store().add_files(self.pinfo['md5'])
             self.save_project()
             os.remove(os.path.join(os.getcwd(), self.path, dump_info_file))
 
@@ -147,79 +293,48 @@ class Project:
     def get_processing_status(self):
         self.update_status()
         if 'dump' in self.pinfo.keys():
-            total = 0
-            init = 0
-            downloaded = 0
-            download_started = 0
-            split = 0
-            splitting_started = 0
-            parsed = 0
-            parsing_started = 0
-            post = 0
-            postprocessing_started = 0
-            error = 0
-            done = 0
-            for item, value in self.pinfo['dump'].items():
-                total += 1
-                if value == 'init':
-                    init += 1
-                elif value == 'downloaded':
-                    downloaded += 1
-                elif value == 'download_started':
-                    download_started += 1
-                elif value == 'split':
-                    split += 1
-                elif value == 'splitting_started':
-                    splitting_started += 1
-                elif value == 'parsed':
-                    parsed += 1
-                elif value == 'parsing_started':
-                    parsing_started += 1
-                elif value == 'post':
-                    post += 1
-                elif value == 'postprocessing_started':
-                    postprocessing_started += 1
-                elif value == 'done':
-                    done += 1
-                elif value == 'error':
-                    error += 1
-            print('Total number of files to process: '+str(total))
-            print('Number of files done: ' + str(done))
-            print('Number of files post-processed: ' + str(post))
-            print('Number of files post-processing started: ' + str(postprocessing_started))
-            print('Number of files parsed: ' + str(parsed))
-            print('Number of files parsing_started: ' + str(parsing_started))
-            print('Number of files split: ' + str(split))
-            print('Number of files splitting started: ' + str(splitting_started))
-            print('Number of files downloaded: ' + str(downloaded))
-            print('Number of files download started: ' + str(download_started))
-            print('Number of files with errors: ' + str(error))
-            print('Number of files not yet started: ' + str(init))
+            counts = self.store().counts()
+            print('Total number of files to process: '+str(sum(counts.values())))
+            print('Number of files done: ' + str(counts.get('done', 0)))
+            print('Number of files post-processed: ' + str(counts.get('post', 0)))
+            print('Number of files post-processing started: ' + str(counts.get('postprocessing_started', 0)))
+            print('Number of files parsed: ' + str(counts.get('parsed', 0)))
+            print('Number of files parsing_started: ' + str(counts.get('parsing_started', 0)))
+            print('Number of files split: ' + str(counts.get('split', 0)))
+            print('Number of files splitting started: ' + str(counts.get('splitting_started', 0)))
+            print('Number of files downloaded: ' + str(counts.get('downloaded', 0)))
+            print('Number of files download started: ' + str(counts.get('download_started', 0)))
+            print('Number of files with errors: ' + str(counts.get('error', 0)))
+            print('Number of files not yet started: ' + str(counts.get('init', 0)))
         else:
             print("No dump files have been added yet for processing.")
             return
 
     def cleanup(self):
-        for key, value in self.pinfo['dump'].items():
-            if value in ['download_started', 'splitting_started', 'parsed_started', 'postprocessing_started']:
-                # remove downloaded file: rest to error
-                try:
-                    shutil.rmtree(os.path.join(self.data_path, key[:-3]))
-                except:
-                    pass
-                try:
-                    shutil.rmtree(os.path.join(self.data_path, 'results', key[:-3]))
-                except:
-                    pass
-                self.pinfo['dump'][key] = 'error'
-                self.save_project()
+        # Keep partial downloads, they are resumed.
+        self.store().set_all(['download_started'], 'init')
+        interrupted = ['splitting_started', 'parsing_started', 'postprocessing_started']
+        for key in self.store().names(interrupted):
+            self.remove_file_data(key)
+        self.store().set_all(interrupted, 'error')
+        self.update_status()
+
+    # Removes the downloaded, split and parsed data of a dump file after a stage failed or was interrupted,
+    # so it is processed again from the download.
+    def remove_file_data(self, key):
+        try:
+            shutil.rmtree(os.path.join(self.data_path, os.path.splitext(key)[0]))
+        except:
+            pass
+        try:
+            shutil.rmtree(os.path.join(self.data_path, 'results', os.path.splitext(key)[0]))
+        except:
+            pass
 
     def retry_errors(self):
         self.cleanup()
-        for key, value in self.pinfo['dump'].items():
-            if value == 'error':
-                self.pinfo['dump'][key] = 'init'
-                self.save_project()
+        self.store().set_all(['error'], 'init')
+        self.update_status()
 
     def process(self):
         '''
@@ -237,8 +352,12 @@ class Project:
         else:
             self.update_status()
             self.cleanup()
-            Parallel(n_jobs=self.pinfo['parallel_processes'])\
-                (delayed(self.process_file)(f, status) for f, status in self.pinfo['dump'].items())
+            if 'stage_limits' in self.pinfo.keys():
+                Scheduler(self, self.pinfo['stage_limits']).run()
+                self.update_status()
+            else:
+                Parallel(n_jobs=self.pinfo['parallel_processes'])\
+                    (delayed(self.process_file)(f, status) for f, status in self.pinfo['dump'].items())
 
     def process_file(self, f, status):
         while status != 'post':
@@ -257,18 +376,34 @@ class Project:
             else:
                 tmp_status = 'error'
 
-            self.save_tmp_status(f[:-3], tmp_status)
+            self.set_file_status(f, tmp_status)
 
+            stage_status = status
             status = Processor(f, self.data_path, self.pinfo['base_url'], status, self.pinfo['start_date'],
-                               self.pinfo['md5'][f]).process()
-            self.save_tmp_status(f[:-3], status)
+                               self.pinfo['md5'][f], **self.processor_options()).process()
+            if status is None:
+                status = 'error'
+                # Partial downloads are kept and resumed.
+                if stage_status != 'init':
+                    self.remove_file_data(f)
+            self.set_file_status(f, status)
 
     def process_results(self):
         ProcessorResults(self).process()
 
+    # Builds the link and category graphs with the validity interval of every edge from the results of
+    # process_results(), see GraphBuilder.
+    def build_graphs(self, path='parsed_results'):
+        build_graphs(path, title_ids=self.get_title_ids(), delta=self.get_link_output() == 'delta')
+
+    # Links (kind 'links') or categories (kind 'cats') at a date, as a LinkGraph in CSR form.
+    def graph_at(self, date, kind='links', path='parsed_results'):
+        return GraphStore(os.path.join(path, 'graphs', kind)).at(date)
+
     def process_results2(self):
         ProcessorResults(self).combine_parsed_results()
 
-    def combine_old_and_new(self, path=None, cats=None, links=None, page_info=None, revisions=None):
+    def combine_old_and_new(self, path=None, cats=None, links=None, page_info=None, revisions=None,
+                            memory=1073741824):
         ProcessorResults(self).combine_old_and_new(path=path, cats=cats, links=links,
-                                                   page_info=page_info, revisions=revisions)
+                                                   page_info=page_info, revisions=revisions, memory=memory)